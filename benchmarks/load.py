@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+import aiohttp
+import numpy as np
+
+METHODS = ("cosine", "euclidean", "taxicab")
+PERCENTILES = (50, 95, 99)
+OK_STATUSES = (200, 304)
+# Page size of the id crawl, as large as /books comfortably serves.
+ID_PAGE_SIZE = 1000
+
+
+def build_scenarios(ids):
+    scenarios = {
+        "books": lambda: f"/books?page={random.randint(1, 50)}&page_size=20",
+    }
+    for method in METHODS:
+        scenarios[f"similar_{method}"] = (
+            lambda method=method: f"/books/{random.choice(ids)}/similar?method={method}")
+        scenarios[f"similar_{method}_fast"] = (
+            lambda method=method: f"/books/{random.choice(ids)}/similar?method={method}&fast=true")
+    scenarios["image"] = lambda: f"/books/{random.choice(ids)}/image"
+    return scenarios
+
+
+async def fetch_ids(session, base_url, count):
+    # Ids are read through the API in id order, which is the order of their
+    # SHA-256 hashes, i.e. a random sample of the catalogue.
+    ids = []
+    url = f"{base_url}/books?order_by=id&page_size={min(count, ID_PAGE_SIZE)}"
+    while len(ids) < count:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            ids += [book["id"] for book in await response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        url = f"{base_url}/books?cursor={cursor}&page_size={min(count - len(ids), ID_PAGE_SIZE) or 1}"
+    if not ids:
+        raise RuntimeError("The API returned no books; seed the catalogue first.")
+    return ids[:count]
+
+
+async def run_scenario(session, base_url, make_path, concurrency, duration, warmup):
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    latencies = []
+    statuses = Counter()
+
+    async def worker():
+        while True:
+            request_started = time.perf_counter()
+            if request_started >= deadline:
+                return
+            try:
+                async with session.get(base_url + make_path()) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = "error"
+            if request_started >= measure_from:
+                latencies.append(time.perf_counter() - request_started)
+                statuses[status] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    latencies_ms = np.array(latencies) * 1000
+    errors = sum(count for status, count in statuses.items() if status not in OK_STATUSES)
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(len(latencies) / duration, 2),
+    }
+    if len(latencies):
+        result["latency_ms"] = {
+            **{f"p{p}": round(float(np.percentile(latencies_ms, p)), 3) for p in PERCENTILES},
+            "mean": round(float(latencies_ms.mean()), 3),
+            "max": round(float(latencies_ms.max()), 3),
+        }
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(base_url, scenario_names, concurrency, duration, warmup, id_count, label):
+    timeout = aiohttp.ClientTimeout(total=30)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        ids = await fetch_ids(session, base_url, id_count)
+        scenarios = build_scenarios(ids)
+        unknown = set(scenario_names or ()) - set(scenarios)
+        if unknown:
+            raise ValueError(
+                f"Unknown scenarios {', '.join(sorted(unknown))}, expected {', '.join(scenarios)}.")
+
+        results = {}
+        for name in scenario_names or scenarios:
+            print(f"Running {name} ({concurrency} concurrent clients, {duration}s)...")
+            results[name] = await run_scenario(
+                session, base_url, scenarios[name], concurrency, duration, warmup)
+            latency = results[name].get("latency_ms", {})
+            print(f"  {results[name]['throughput_rps']} req/s, "
+                  f"p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+                  f"{results[name]['errors']} errors")
+
+    return {
+        "meta": {
+            "label": label,
+            "revision": git_revision(),
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "base_url": base_url,
+            "concurrency": concurrency,
+            "duration_s": duration,
+            "warmup_s": warmup,
+            "ids": len(ids),
+        },
+        "scenarios": results,
+    }
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    with open(candidate_path, 'r') as file:
+        candidate = json.load(file)
+
+    print(f"{'scenario':<24}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, result in candidate["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        before = baseline["scenarios"][name]
+        metrics = [("throughput_rps", before["throughput_rps"], result["throughput_rps"])]
+        metrics += [(f"{p} ms", before.get("latency_ms", {}).get(p), result.get("latency_ms", {}).get(p))
+                    for p in ("p50", "p95", "p99")]
+        for metric, old, new in metrics:
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "n/a"
+            print(f"{name:<24}{metric:<16}{old if old is not None else 'n/a':>12}"
+                  f"{new if new is not None else 'n/a':>12}{change:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the expose API.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Drive the API and write the results as JSON.")
+    run_parser.add_argument('--base-url', default='http://localhost:8000')
+    run_parser.add_argument('--scenarios', nargs='+', help="Scenarios to run (default: all).")
+    run_parser.add_argument('--concurrency', type=int, default=16, help="Concurrent clients (default 16).")
+    run_parser.add_argument('--duration', type=float, default=30, help="Measured seconds per scenario.")
+    run_parser.add_argument('--warmup', type=float, default=5, help="Unmeasured seconds before each scenario.")
+    run_parser.add_argument('--ids', type=int, default=10000, help="Number of book IDs drawn from.")
+    run_parser.add_argument('--label', help="Free-form label stored with the results.")
+    run_parser.add_argument('--output', help="JSON file to write (default: stdout).")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files.")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        compare(args.baseline, args.candidate)
+    else:
+        report = asyncio.run(run(args.base_url.rstrip('/'), args.scenarios, args.concurrency,
+                                 args.duration, args.warmup, args.ids, args.label))
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2)
+            print(f"Results written to {args.output}.")
+        else:
+            print(json.dumps(report, indent=2))
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from common.utils import reconnect, TABLE_NAME
+from microservices.images import generate_image_path, save_image_webp
+from store.indexes import SCHEMA_PATH, create_vector_indexes, create_search_index
+from common.facets import refresh_facets_view
+
+COLUMNS = [
+    'id', 'product_title', 'author', 'resume', 'labels', 'image_url', 'collection',
+    'date_de_parution', 'ean', 'editeur', 'format', 'isbn', 'nb_de_pages', 'poids',
+    'presentation', 'width', 'height', 'depth', 'embedding', 'tfidf', 'utils'
+]
+EMBEDDING_DIM = 128
+TFIDF_DIM = 4096
+TFIDF_NONZERO = 50
+COVER_URL_PREFIX = 'https://covers.invalid/benchmark/'
+FORMATS = ['poche', 'grand format', 'broche', 'relie']
+PRESENTATIONS = ['broche', 'relie', 'coffret']
+LABELS = ['roman', 'policier', 'fantasy', 'science-fiction', 'histoire', 'jeunesse',
+          'bande dessinee', 'poesie', 'theatre', 'biographie', 'essai', 'cuisine']
+WORDS = ['livre', 'histoire', 'roman', 'aventure', 'amour', 'guerre', 'enfant', 'ville',
+         'mystere', 'enquete', 'famille', 'voyage', 'secret', 'monde', 'temps', 'nuit',
+         'heros', 'reine', 'pouvoir', 'memoire', 'ocean', 'montagne', 'ecole', 'ami']
+
+
+def encode_vector(vector):
+    # pgvector binary format: dimension, unused, then big-endian float4 values.
+    return struct.pack('>HH', len(vector), 0) + np.asarray(vector, dtype='>f4').tobytes()
+
+
+def decode_vector(data):
+    dim = struct.unpack('>HH', data[:4])[0]
+    return np.frombuffer(data[4:4 + dim * 4], dtype='>f4')
+
+
+def synthetic_chunk(rng, start, count, rows, centers, covers, with_tfidf):
+    clusters = rng.integers(len(centers), size=count)
+    embeddings = (centers[clusters] + 0.3 * rng.standard_normal(
+        (count, EMBEDDING_DIM))).astype(np.float32)
+
+    if with_tfidf:
+        tfidf = np.zeros((count, TFIDF_DIM), dtype=np.float32)
+        columns = rng.integers(TFIDF_DIM, size=(count, TFIDF_NONZERO))
+        np.put_along_axis(tfidf, columns, rng.random((count, TFIDF_NONZERO), dtype=np.float32), axis=1)
+        tfidf /= np.linalg.norm(tfidf, axis=1, keepdims=True)
+
+    n_authors = rows // 20 + 1
+    records = []
+    for offset in range(count):
+        i = start + offset
+        records.append((
+            hashlib.sha256(f"benchmark-{i}".encode()).hexdigest(),
+            f"livre {i}",
+            f"auteur_{rng.integers(n_authors)}",
+            " ".join(rng.choice(WORDS, size=60)),
+            json.dumps(rng.choice(LABELS, size=rng.integers(1, 4), replace=False).tolist()),
+            f"{COVER_URL_PREFIX}{i % covers}.jpg",
+            f"collection_{rng.integers(n_authors // 10 + 1)}" if rng.random() < 0.7 else None,
+            date(1990, 1, 1) + timedelta(days=int(rng.integers(12000))) if rng.random() < 0.95 else None,
+            9780000000000 + i,
+            f"editeur_{rng.integers(n_authors // 50 + 1)}",
+            FORMATS[rng.integers(len(FORMATS))],
+            f"978-{i}",
+            int(rng.integers(50, 900)),
+            Decimal(f"{rng.uniform(0.1, 1.5):.3f}"),
+            PRESENTATIONS[rng.integers(len(PRESENTATIONS))],
+            Decimal(f"{rng.uniform(10, 25):.2f}"),
+            Decimal(f"{rng.uniform(15, 32):.2f}"),
+            Decimal(f"{rng.uniform(0.5, 6):.2f}"),
+            embeddings[offset],
+            tfidf[offset] if with_tfidf else None,
+            json.dumps({'image_downloaded': True, 'dynamic_cluster_number': int(clusters[offset])}),
+        ))
+    return records
+
+
+def write_covers(covers):
+    # Every book points to one of these covers, so /books/{book_id}/image is
+    # served from disk and never tries to download the fake URLs.
+    buffer = BytesIO()
+    Image.new('RGB', (300, 450), (120, 80, 40)).save(buffer, format='JPEG')
+    for i in range(covers):
+        image_path = generate_image_path(f"{COVER_URL_PREFIX}{i}.jpg")
+        if not os.path.exists(image_path):
+            save_image_webp(buffer.getvalue(), image_path)
+
+
+async def create_table(conn, replace):
+    with open(SCHEMA_PATH, 'r') as file:
+        schema = json.load(file)
+
+    exists = await conn.fetchval(
+        "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = $1)", TABLE_NAME)
+    if exists and not replace:
+        raise RuntimeError(
+            f"Table {TABLE_NAME} already exists; pass --replace to drop it and seed a new catalogue.")
+
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME} CASCADE")
+    columns = ", ".join(f"{col['name']} {col['type']}" for col in schema['columns'])
+    await conn.execute(f"CREATE TABLE {TABLE_NAME} ({columns})")
+
+
+async def seed(rows, chunk_size, covers, clusters, with_tfidf, replace, neighbors, snapshot, seed_value):
+    rng = np.random.default_rng(seed_value)
+    conn = await reconnect()
+    try:
+        await create_table(conn, replace)
+        await conn.set_type_codec(
+            'vector', schema='public', encoder=encode_vector, decoder=decode_vector, format='binary')
+
+        centers = rng.standard_normal((clusters, EMBEDDING_DIM)).astype(np.float32)
+        started = time.perf_counter()
+        for start in range(0, rows, chunk_size):
+            records = synthetic_chunk(
+                rng, start, min(chunk_size, rows - start), rows, centers, covers, with_tfidf)
+            await conn.copy_records_to_table(TABLE_NAME, records=records, columns=COLUMNS)
+            print(f"Inserted {start + len(records)}/{rows} rows.")
+        print(f"Loaded {rows} rows in {time.perf_counter() - started:.1f}s.")
+
+        # Indexes are built once the table is filled, which is much faster
+        # than maintaining them row by row.
+        started = time.perf_counter()
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_date_de_parution_id_idx ON {TABLE_NAME} (date_de_parution, id)")
+        await create_vector_indexes(conn)
+        await create_search_index(conn)
+        await conn.execute(f"ANALYZE {TABLE_NAME}")
+        await refresh_facets_view(conn)
+        print(f"Built indexes in {time.perf_counter() - started:.1f}s.")
+
+        # The vectorizer helpers below read the vectors as pgvector text.
+        await conn.reset_type_codec('vector', schema='public')
+        if neighbors:
+            from microservices.utils.neighbors import update_neighbors
+            await update_neighbors(conn, [], recalculate_all=True)
+        if snapshot:
+            from microservices.utils.snapshot import publish_embedding_snapshot
+            await publish_embedding_snapshot(conn)
+    finally:
+        await conn.close()
+
+    write_covers(covers)
+    print(f"Wrote {covers} covers.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Seed TABLE_NAME with a synthetic catalogue for the expose benchmarks.")
+    parser.add_argument('--rows', type=int, default=10000, help="Number of books (default 10000).")
+    parser.add_argument('--chunk-size', type=int, default=2000, help="Rows generated and copied per batch.")
+    parser.add_argument('--covers', type=int, default=1000, help="Number of distinct cover files.")
+    parser.add_argument('--clusters', type=int, default=50, help="Number of clusters of the embeddings.")
+    parser.add_argument('--tfidf', action=argparse.BooleanOptionalAction, default=True,
+                        help="Fill the 4096-d tfidf column (about 16 KB per row).")
+    parser.add_argument('--neighbors', action='store_true',
+                        help="Precompute the book_neighbors table, as the vectorizer does.")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="Publish the embedding snapshot of the in-memory engine.")
+    parser.add_argument('--replace', action='store_true', help="Drop TABLE_NAME if it exists.")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed.")
+    args = parser.parse_args()
+
+    asyncio.run(seed(args.rows, args.chunk_size, args.covers, args.clusters, args.tfidf,
+                     args.replace, args.neighbors, args.snapshot, args.seed))
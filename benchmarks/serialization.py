@@ -0,0 +1,89 @@
+import json
+import random
+import timeit
+from datetime import date
+from decimal import Decimal
+from expose.models import Book
+from expose.serializers import BooksResponse, encode_books
+
+
+def legacy_row_to_book(row):
+    return {
+        "id": row['id'],
+        "product_title": row.get('product_title'),
+        "author": row.get('author'),
+        "resume": row.get('resume'),
+        "image_url": row.get('image_url'),
+        "collection": row.get('collection'),
+        "date_de_parution": str(row['date_de_parution']) if row.get('date_de_parution') is not None else '',
+        "ean": row.get('ean'),
+        "editeur": row.get('editeur'),
+        "format": row.get('format'),
+        "isbn": row.get('isbn'),
+        "nb_de_pages": row.get('nb_de_pages'),
+        "poids": float(row['poids']) if row.get('poids') is not None and -1e308 < float(row['poids']) < 1e308 else None,
+        "presentation": row.get('presentation'),
+        "width": float(row['width']) if row.get('width') is not None and -1e308 < float(row['width']) < 1e308 else None,
+        "height": float(row['height']) if row.get('height') is not None and -1e308 < float(row['height']) < 1e308 else None,
+        "depth": float(row['depth']) if row.get('depth') is not None and -1e308 < float(row['depth']) < 1e308 else None,
+    }
+
+
+def legacy_path(rows):
+    # Hand-built dicts, then validated and dumped through the response_model.
+    books = [legacy_row_to_book(row) for row in rows]
+    validated = [Book.model_validate(book).model_dump(mode='json') for book in books]
+    return json.dumps(validated).encode('utf-8')
+
+
+def fast_path(rows):
+    return BooksResponse(encode_books(rows)).body
+
+
+def synthetic_rows(count):
+    rows = []
+    for i in range(count):
+        rows.append({
+            "id": f"{i:064x}",
+            "product_title": f"livre_{i}",
+            "author": random.choice(["victor_hugo", "emile_zola", None]),
+            "resume": "lorem ipsum dolor sit amet " * 20,
+            "image_url": f"https://example.com/{i}.jpg",
+            "collection": random.choice(["folio", "poche", None]),
+            "date_de_parution": random.choice([date(2020, 1, 1 + i % 28), None]),
+            "ean": 9780000000000 + i,
+            "editeur": "gallimard",
+            "format": "poche",
+            "isbn": f"978-{i}",
+            "nb_de_pages": 320,
+            "poids": Decimal("0.250"),
+            "presentation": "broche",
+            "width": Decimal("11.00"),
+            "height": Decimal("17.80"),
+            "depth": random.choice([Decimal("2.10"), None]),
+        })
+    return rows
+
+
+def main(page_sizes, repeat):
+    print(f"{'rows':>6} {'legacy (ms)':>12} {'fast (ms)':>10} {'speedup':>8}")
+    for page_size in page_sizes:
+        rows = synthetic_rows(page_size)
+        assert json.loads(legacy_path(rows)) == json.loads(fast_path(rows))
+        legacy = min(timeit.repeat(lambda: legacy_path(rows), number=repeat, repeat=5)) / repeat
+        fast = min(timeit.repeat(lambda: fast_path(rows), number=repeat, repeat=5)) / repeat
+        print(f"{page_size:>6} {legacy * 1000:>12.3f} {fast * 1000:>10.3f} {legacy / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare the legacy and fast book serialisation paths.")
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Number of rows serialised per response.")
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="Number of serialisations timed per measure.")
+
+    args = parser.parse_args()
+    main(args.page_sizes, args.repeat)
@@ -0,0 +1,45 @@
+import asyncpg
+from common.utils import TABLE_NAME
+
+FACETS_VIEW = 'book_facets'
+FACET_COLUMNS = ['author', 'editeur', 'collection', 'format']
+FACETS = FACET_COLUMNS + ['labels']
+
+
+def facet_counts_query(source, facets=FACETS):
+    # One count per (facet, value), plus the number of books under the
+    # 'total' facet. `source` is a table or a CTE with the facet columns.
+    parts = [
+        f"SELECT '{column}'::text AS facet, {column}::text AS value, count(*) AS count "
+        f"FROM {source} s WHERE {column} IS NOT NULL GROUP BY {column}"
+        for column in FACET_COLUMNS if column in facets
+    ]
+    if 'labels' in facets:
+        parts.append(
+            f"SELECT 'labels'::text AS facet, label AS value, count(*) AS count "
+            f"FROM {source} s, jsonb_array_elements_text(s.labels) AS label GROUP BY label")
+    parts.append(f"SELECT 'total'::text AS facet, ''::text AS value, count(*) AS count FROM {source} s")
+    return "\nUNION ALL\n".join(parts)
+
+
+async def create_facets_view(conn):
+    await conn.execute(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {FACETS_VIEW} AS
+        {facet_counts_query(TABLE_NAME)}
+    """)
+    # The unique index allows REFRESH ... CONCURRENTLY, the second one reads
+    # the top values of a facet in count order.
+    await conn.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {FACETS_VIEW}_facet_value_idx ON {FACETS_VIEW} (facet, value)")
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {FACETS_VIEW}_facet_count_idx ON {FACETS_VIEW} (facet, count DESC)")
+
+
+async def refresh_facets_view(conn):
+    # CONCURRENTLY recomputes the counts but only writes the rows that
+    # changed, and never blocks the API reading the view meanwhile.
+    try:
+        await conn.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {FACETS_VIEW}")
+    except asyncpg.exceptions.UndefinedTableError:
+        await create_facets_view(conn)
+    print(f"Refreshed the {FACETS_VIEW} facet counts.")
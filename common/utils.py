@@ -51,3 +51,28 @@ async def execute_batch_updates(conn, updates, query):
     if retries == max_retries:
         raise RuntimeError(
             "Max retries reached. Failed to execute batch updates.")
+
+
+VECTORS_VERSION_CHANNEL = 'books_vectors_updated'
+
+
+async def bump_vectors_version(conn):
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache_versions (name TEXT PRIMARY KEY, version BIGINT NOT NULL)")
+    version = await conn.fetchval("""
+        INSERT INTO cache_versions (name, version) VALUES ($1, 1)
+        ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1
+        RETURNING version
+    """, TABLE_NAME)
+    await conn.execute("SELECT pg_notify($1, $2)", VECTORS_VERSION_CHANNEL, str(version))
+    print(f"Published vectors version {version}.")
+    return version
+
+
+async def fetch_vectors_version(conn):
+    try:
+        version = await conn.fetchval(
+            "SELECT version FROM cache_versions WHERE name = $1", TABLE_NAME)
+    except asyncpg.exceptions.UndefinedTableError:
+        return 0
+    return version or 0
@@ -0,0 +1,79 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import asyncpg
+from expose.config import ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT
+
+RESULTS = ("admitted", "queue_full", "queue_timeout", "statement_timeout", "degraded")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionLimiter:
+    def __init__(self, concurrency=ADMISSION_CONCURRENCY, queue_size=ADMISSION_QUEUE_SIZE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.counts = defaultdict(int)
+
+    @asynccontextmanager
+    async def admit(self):
+        # A request runs at once while fewer than `concurrency` are running,
+        # otherwise waits in a bounded queue; a full queue or a wait longer
+        # than `queue_timeout` sheds it instead of piling up.
+        if self.semaphore.locked() and self.waiting >= self.queue_size:
+            self.counts["queue_full"] += 1
+            raise Overloaded("queue full")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counts["queue_timeout"] += 1
+            raise Overloaded("queue timeout")
+        finally:
+            self.waiting -= 1
+
+        self.counts["admitted"] += 1
+        self.active += 1
+        try:
+            yield
+        except asyncpg.exceptions.QueryCanceledError:
+            self.counts["statement_timeout"] += 1
+            raise
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def degraded(self):
+        self.counts["degraded"] += 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            **{result: self.counts[result] for result in RESULTS},
+        }
+
+
+# One limiter per expensive route, so a burst on one of them cannot take
+# every pooled connection; the cluster-restricted searches have their own,
+# as they are the fallback of the full ones.
+limiters = {
+    "similar": AdmissionLimiter(),
+    "similar_fast": AdmissionLimiter(),
+    "similar_batch": AdmissionLimiter(),
+    "similar_basket": AdmissionLimiter(),
+}
+
+
+def get_admission_stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,227 @@
+import asyncio
+import importlib
+import time
+from abc import ABC, abstractmethod
+import asyncpg
+from collections import OrderedDict
+from expose.config import (
+    POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB,
+    SIMILAR_CACHE_BACKEND, SIMILAR_CACHE_SIZE, SIMILAR_CACHE_TTL
+)
+from expose.metrics import record_cache
+from common.utils import VECTORS_VERSION_CHANNEL, fetch_vectors_version
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key):
+        ...
+
+    @abstractmethod
+    async def set(self, key, value, ttl):
+        ...
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+    def size(self):
+        return None
+
+
+class LocalCache(CacheBackend):
+    def __init__(self, max_size=SIMILAR_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def clear(self):
+        self.entries.clear()
+
+    def size(self):
+        return len(self.entries)
+
+
+def load_backend(spec):
+    if spec == "local":
+        return LocalCache()
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise RuntimeError(
+            f"Invalid SIMILAR_CACHE_BACKEND '{spec}': expected 'local' or 'module:Class'.")
+    backend = getattr(importlib.import_module(module_name), class_name)()
+    if not isinstance(backend, CacheBackend):
+        raise RuntimeError(f"{spec} is not a CacheBackend.")
+    return backend
+
+
+class SimilarCache:
+    def __init__(self, backend, ttl=SIMILAR_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, book_id, *options):
+        flags = ":".join(str(option) for option in options)
+        return f"similar:v{self.version}:{book_id}:{flags}"
+
+    async def get(self, key):
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        record_cache(value is not None)
+        return value
+
+    async def set(self, key, value):
+        await self.backend.set(key, value, self.ttl)
+
+    async def set_version(self, version):
+        if version == self.version:
+            return
+        self.version = version
+        self.invalidations += 1
+        # Shared backends keep older versions until their TTL, local entries
+        # are unreachable from now on and only waste memory.
+        if isinstance(self.backend, LocalCache):
+            await self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "version": self.version,
+            "size": self.backend.size(),
+            "max_size": SIMILAR_CACHE_SIZE,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+similar_cache = SimilarCache(load_backend(SIMILAR_CACHE_BACKEND))
+
+# The listener connection is checked every LISTENER_CHECK_INTERVAL seconds
+# and reopened with an exponential backoff when it is lost.
+LISTENER_CHECK_INTERVAL = 30
+LISTENER_CHECK_TIMEOUT = 10
+LISTENER_RETRY_DELAY = 1
+LISTENER_MAX_RETRY_DELAY = 60
+LISTENER_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+listener_task = None
+version_callbacks = []
+
+
+def on_vectors_version(callback):
+    version_callbacks.append(callback)
+
+
+def switch_version(version):
+    asyncio.ensure_future(similar_cache.set_version(version))
+    for callback in version_callbacks:
+        asyncio.ensure_future(callback(version))
+
+
+def on_vectors_updated(connection, pid, channel, payload):
+    print(f"Vectors version {payload} published, invalidating similar cache.")
+    switch_version(int(payload))
+
+
+async def connect_listener():
+    conn = await asyncpg.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        database=POSTGRES_DB,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+    try:
+        await conn.add_listener(VECTORS_VERSION_CHANNEL, on_vectors_updated)
+        # Read once listening, so a version published while the listener was
+        # down still invalidates the cache.
+        version = await fetch_vectors_version(conn)
+    except BaseException:
+        conn.terminate()
+        raise
+    if version != similar_cache.version:
+        print(f"Vectors version {version} read, invalidating similar cache.")
+        switch_version(version)
+    return conn
+
+
+async def wait_until_lost(conn):
+    lost = asyncio.Event()
+    conn.add_termination_listener(lambda _: lost.set())
+    try:
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), LISTENER_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                # A dropped network does not always close the socket, a
+                # query does notice it.
+                await conn.fetchval("SELECT 1", timeout=LISTENER_CHECK_TIMEOUT)
+    except LISTENER_ERRORS as e:
+        print(f"Cache listener connection failed: {e}")
+    finally:
+        if not conn.is_closed():
+            conn.terminate()
+
+
+async def run_cache_listener(conn):
+    delay = LISTENER_RETRY_DELAY
+    while True:
+        if conn is None:
+            try:
+                conn = await connect_listener()
+            except LISTENER_ERRORS as e:
+                print(f"Cache listener cannot reconnect: {e}. Retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTENER_MAX_RETRY_DELAY)
+                continue
+            print("Cache listener reconnected.")
+            delay = LISTENER_RETRY_DELAY
+        await wait_until_lost(conn)
+        print("Cache listener lost its connection, reconnecting.")
+        conn = None
+
+
+async def start_cache_listener():
+    # The first connection is opened before the app serves, so the cache
+    # starts on the current version.
+    global listener_task
+    conn = await connect_listener()
+    listener_task = asyncio.create_task(run_cache_listener(conn))
+
+
+async def stop_cache_listener():
+    global listener_task
+    if listener_task is not None:
+        listener_task.cancel()
+        try:
+            await listener_task
+        except asyncio.CancelledError:
+            pass
+        listener_task = None
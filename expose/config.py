@@ -9,3 +9,42 @@ POSTGRES_HOST = os.getenv('POSTGRES_HOST')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT')
 POSTGRES_DB = os.getenv('POSTGRES_DB')
 TABLE_NAME = os.getenv('TABLE_NAME')
+SEARCH_CONFIG = 'french_unaccent'
+
+POOL_MIN_SIZE = int(os.getenv('POOL_MIN_SIZE', 2))
+POOL_MAX_SIZE = int(os.getenv('POOL_MAX_SIZE', 10))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('POOL_ACQUIRE_TIMEOUT', 5))
+POOL_STATEMENT_CACHE_SIZE = int(os.getenv('POOL_STATEMENT_CACHE_SIZE', 100))
+POOL_MAX_INACTIVE_LIFETIME = float(
+    os.getenv('POOL_MAX_INACTIVE_LIFETIME', 300))
+POOL_WARMUP = os.getenv('POOL_WARMUP', 'true').lower() == 'true'
+
+if POOL_MIN_SIZE < 0 or POOL_MAX_SIZE <= 0 or POOL_MIN_SIZE > POOL_MAX_SIZE:
+    raise RuntimeError(
+        "Invalid pool size: POOL_MIN_SIZE must be between 0 and POOL_MAX_SIZE.")
+
+SIMILAR_CACHE_BACKEND = os.getenv('SIMILAR_CACHE_BACKEND', 'local')
+SIMILAR_CACHE_SIZE = int(os.getenv('SIMILAR_CACHE_SIZE', 4096))
+SIMILAR_CACHE_TTL = float(os.getenv('SIMILAR_CACHE_TTL', 3600))
+SIMILAR_BATCH_MAX_IDS = int(os.getenv('SIMILAR_BATCH_MAX_IDS', 100))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT', 10))
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 2592000))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 1024))
+SEMANTIC_PRELOAD = os.getenv('SEMANTIC_PRELOAD', 'false').lower() == 'true'
+HYBRID_WEIGHTS_PATH = os.getenv(
+    'HYBRID_WEIGHTS_PATH', 'data/schemes/weights.json')
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 100))
+SIMILAR_PRECOMPUTED = os.getenv('SIMILAR_PRECOMPUTED', 'true').lower() == 'true'
+METRICS_TIMING_HEADER = os.getenv('METRICS_TIMING_HEADER', 'false').lower() == 'true'
+QUERY_REGISTRY_SIZE = int(os.getenv('QUERY_REGISTRY_SIZE', 64))
+ADMISSION_CONCURRENCY = int(
+    os.getenv('ADMISSION_CONCURRENCY', max(POOL_MAX_SIZE // 4, 1)))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 1))
+SIMILAR_STATEMENT_TIMEOUT = int(os.getenv('SIMILAR_STATEMENT_TIMEOUT', 2000))
+
+if ADMISSION_CONCURRENCY <= 0 or ADMISSION_QUEUE_SIZE < 0:
+    raise RuntimeError(
+        "Invalid admission control: ADMISSION_CONCURRENCY must be positive and ADMISSION_QUEUE_SIZE non-negative.")
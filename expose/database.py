@@ -1,13 +1,108 @@
+import asyncio
+import time
 import asyncpg
-from expose.config import POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from expose.config import (
+    POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_ACQUIRE_TIMEOUT, POOL_STATEMENT_CACHE_SIZE,
+    POOL_MAX_INACTIVE_LIFETIME, POOL_WARMUP
+)
+from expose.metrics import record, record_query
+from expose.queries import query_registry
 
+pool = None
 
-async def get_db_connection():
-    conn = await asyncpg.connect(
+pool_stats = {
+    "acquired": 0,
+    "in_use": 0,
+    "max_in_use": 0,
+    "timeouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+}
+
+
+async def init_pool():
+    global pool
+    pool = await asyncpg.create_pool(
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
         database=POSTGRES_DB,
         host=POSTGRES_HOST,
-        port=POSTGRES_PORT
+        port=POSTGRES_PORT,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        statement_cache_size=POOL_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=POOL_MAX_INACTIVE_LIFETIME,
+        init=init_connection
     )
-    return conn
+    if POOL_WARMUP:
+        await warmup_pool()
+    print(f"Database pool ready (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE}).")
+    return pool
+
+
+async def init_connection(conn):
+    conn.add_query_logger(record_query)
+    query_registry.attach(conn)
+
+
+async def warmup_pool():
+    async def ping():
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+
+    await asyncio.gather(*(ping() for _ in range(max(POOL_MIN_SIZE, 1))))
+
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def acquire_connection():
+    if pool is None:
+        raise RuntimeError(
+            "Database pool is not initialized. Please run init_pool first.")
+
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool_stats["timeouts"] += 1
+        raise HTTPException(
+            status_code=503, detail="Database pool exhausted")
+    wait_time = time.perf_counter() - start
+    record("pool_wait", wait_time)
+
+    pool_stats["acquired"] += 1
+    pool_stats["wait_time_total"] += wait_time
+    pool_stats["wait_time_max"] = max(pool_stats["wait_time_max"], wait_time)
+    pool_stats["in_use"] += 1
+    pool_stats["max_in_use"] = max(
+        pool_stats["max_in_use"], pool_stats["in_use"])
+    try:
+        yield conn
+    finally:
+        pool_stats["in_use"] -= 1
+        await pool.release(conn)
+
+
+def get_pool_stats():
+    acquired = pool_stats["acquired"]
+    return {
+        "size": pool.get_size() if pool is not None else 0,
+        "idle": pool.get_idle_size() if pool is not None else 0,
+        "min_size": POOL_MIN_SIZE,
+        "max_size": POOL_MAX_SIZE,
+        "in_use": pool_stats["in_use"],
+        "max_in_use": pool_stats["max_in_use"],
+        "acquired": acquired,
+        "timeouts": pool_stats["timeouts"],
+        "wait_time_avg": pool_stats["wait_time_total"] / acquired if acquired else 0.0,
+        "wait_time_max": pool_stats["wait_time_max"],
+    }
@@ -0,0 +1,84 @@
+import io
+import json
+import pyarrow as pa
+from expose.serializers import BOOK_COLUMNS
+
+VECTOR_COLUMNS = ["embedding", "tfidf"]
+
+ARROW_FIELDS = {
+    "id": pa.string(),
+    "product_title": pa.string(),
+    "author": pa.string(),
+    "resume": pa.string(),
+    "image_url": pa.string(),
+    "collection": pa.string(),
+    "date_de_parution": pa.date32(),
+    "ean": pa.int64(),
+    "editeur": pa.string(),
+    "format": pa.string(),
+    "isbn": pa.string(),
+    "nb_de_pages": pa.int32(),
+    "poids": pa.float64(),
+    "presentation": pa.string(),
+    "width": pa.float64(),
+    "height": pa.float64(),
+    "depth": pa.float64(),
+    "embedding": pa.list_(pa.float32()),
+    "tfidf": pa.list_(pa.float32()),
+}
+
+
+def export_columns(include_vectors):
+    return BOOK_COLUMNS + (VECTOR_COLUMNS if include_vectors else [])
+
+
+def parse_vector(value):
+    # pgvector values come back as their text form, e.g. "[0.1,0.2]".
+    return json.loads(value) if value is not None else None
+
+
+def encode_ndjson(rows, columns):
+    lines = []
+    for row in rows:
+        record = {}
+        for column in columns:
+            value = row[column]
+            if column in VECTOR_COLUMNS:
+                value = parse_vector(value)
+            elif column == "date_de_parution":
+                value = value.isoformat() if value is not None else None
+            elif value is not None and column in ("poids", "width", "height", "depth"):
+                value = float(value)
+            record[column] = value
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class ArrowStreamEncoder:
+    def __init__(self, columns):
+        self.columns = columns
+        self.schema = pa.schema([(column, ARROW_FIELDS[column]) for column in columns])
+        self.sink = io.BytesIO()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def drain(self):
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def encode(self, rows):
+        arrays = []
+        for column in self.columns:
+            values = [row[column] for row in rows]
+            if column in VECTOR_COLUMNS:
+                values = [parse_vector(value) for value in values]
+            elif column in ("poids", "width", "height", "depth"):
+                values = [float(value) if value is not None else None for value in values]
+            arrays.append(pa.array(values, type=ARROW_FIELDS[column]))
+        self.writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        return self.drain()
+
+    def close(self):
+        self.writer.close()
+        return self.drain()
@@ -0,0 +1,39 @@
+import hashlib
+import os
+from functools import lru_cache
+from email.utils import formatdate, parsedate_to_datetime
+
+
+@lru_cache(maxsize=65536)
+def content_etag(path, mtime_ns, size):
+    # mtime and size are part of the key so a rewritten file is hashed again.
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()}"'
+
+
+def file_validators(path):
+    stat = os.stat(path)
+    etag = content_etag(path, stat.st_mtime_ns, stat.st_size)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    return etag, last_modified, stat
+
+
+def is_not_modified(request_headers, etag, mtime):
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
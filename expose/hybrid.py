@@ -0,0 +1,122 @@
+import json
+import os
+import numpy as np
+from expose.config import HYBRID_WEIGHTS_PATH
+
+CATEGORICAL_COLUMNS = ("author", "collection", "editeur")
+FEATURE_SELECT = "embedding, tfidf, labels"
+
+
+def parse_weights(raw):
+    # The embedding and tfidf columns are computed from the resume and the
+    # title together, so the per-field weights of weights.json are summed
+    # into one weight per column.
+    embedding_weights = raw.get("embedding_weights", {})
+    categorical_weights = raw.get("categorical_weights", {})
+    return {
+        "embedding": float(embedding_weights.get("resume", 0) + embedding_weights.get("product_title", 0)),
+        "tfidf": float(embedding_weights.get("resume_tfidf", 0) + embedding_weights.get("product_title_tfidf", 0)),
+        "categorical": {column: float(categorical_weights.get(column, 0)) for column in CATEGORICAL_COLUMNS},
+        "labels": float(raw.get("labels_weight", 0)),
+    }
+
+
+class HybridWeights:
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = None
+        self.weights = None
+        self.reloads = 0
+
+    def get(self):
+        # The file is stat()ed on every request so that an edited weights.json
+        # is picked up without restarting the API. A file caught half-written
+        # keeps the previous weights until the next successful read.
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if mtime_ns == self.mtime_ns:
+                return self.weights
+            with open(self.path) as f:
+                weights = parse_weights(json.load(f))
+        except (OSError, ValueError, AttributeError) as e:
+            if self.weights is None:
+                raise RuntimeError(f"Invalid weights file {self.path}: {e}")
+            print(f"Ignoring invalid weights file {self.path}: {e}")
+            return self.weights
+
+        self.weights = weights
+        self.mtime_ns = mtime_ns
+        self.reloads += 1
+        print(f"Loaded hybrid weights from {self.path}: {weights}")
+        return self.weights
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "weights": self.weights,
+            "version": self.mtime_ns,
+            "reloads": self.reloads,
+        }
+
+
+hybrid_weights = HybridWeights(HYBRID_WEIGHTS_PATH)
+
+
+def vector_matrix(values):
+    # pgvector text values ("[0.1,0.2,...]") are joined and parsed in a single
+    # call; rows with a NULL vector are left at zero and score 0.
+    present = [index for index, value in enumerate(values) if value is not None]
+    if not present:
+        return np.zeros((len(values), 1), dtype=np.float32)
+    flat = np.fromstring(
+        ",".join(values[index][1:-1] for index in present), sep=',', dtype=np.float32)
+    matrix = np.zeros((len(values), flat.size // len(present)), dtype=np.float32)
+    matrix[present] = flat.reshape(len(present), -1)
+    return matrix
+
+
+def cosine_scores(matrix, vector):
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    dots = matrix @ vector
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+def label_set(labels):
+    if isinstance(labels, str):
+        labels = json.loads(labels)
+    return set(labels or ())
+
+
+def jaccard_scores(seed_labels, candidate_labels):
+    seed = label_set(seed_labels)
+    candidates = [label_set(labels) for labels in candidate_labels]
+    intersections = np.array([len(seed & labels) for labels in candidates], dtype=np.float32)
+    unions = np.array([len(labels) for labels in candidates], dtype=np.float32) + len(seed) - intersections
+    return np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+
+
+def rerank(seed, candidates, weights, k=5):
+    # The ANN metric only picks the candidate set; the re-ranking always uses
+    # cosine similarities so that every term stays on a comparable scale.
+    if not candidates:
+        return []
+
+    vectors = vector_matrix([seed['embedding']] + [row['embedding'] for row in candidates])
+    scores = weights["embedding"] * cosine_scores(vectors[1:], vectors[0])
+
+    if weights["tfidf"]:
+        vectors = vector_matrix([seed['tfidf']] + [row['tfidf'] for row in candidates])
+        scores += weights["tfidf"] * cosine_scores(vectors[1:], vectors[0])
+
+    for column, weight in weights["categorical"].items():
+        if weight and seed[column] is not None:
+            values = np.array([row[column] for row in candidates], dtype=object)
+            scores += weight * (values == seed[column])
+
+    if weights["labels"]:
+        scores += weights["labels"] * jaccard_scores(
+            seed['labels'], [row['labels'] for row in candidates])
+
+    # A stable sort keeps the ANN order between candidates with equal scores.
+    order = np.argsort(-scores, kind='stable')[:k]
+    return [candidates[index] for index in order]
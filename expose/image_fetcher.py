@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import aiohttp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from expose.config import TABLE_NAME, IMAGE_WORKERS, IMAGE_FETCH_TIMEOUT
+from expose.database import acquire_connection
+from microservices.images import download_and_save_image_webp
+
+session = None
+executor = None
+inflight = {}
+
+fetch_stats = {
+    "downloads": 0,
+    "coalesced": 0,
+    "failures": 0,
+}
+
+
+async def start_image_fetcher():
+    global session, executor
+    session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=IMAGE_FETCH_TIMEOUT))
+    executor = create_executor()
+
+
+def create_executor():
+    # spawn: the workers start lazily, once the API runs threads and may
+    # have loaded torch, neither of which is fork-safe.
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+
+async def stop_image_fetcher():
+    global session, executor
+    if session is not None:
+        await session.close()
+        session = None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+def replace_executor(broken):
+    # Concurrent downloads all see the same broken pool: it is replaced once.
+    global executor
+    if executor is broken:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = create_executor()
+
+
+async def download_image(book_ids, image_url, image_path):
+    fetch_stats["downloads"] += 1
+    pool = executor
+    try:
+        image_path = await download_and_save_image_webp(session, image_url, image_path, pool)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Failed to fetch image from {image_url}: {e}")
+        image_path = None
+    except OSError as e:
+        # Not an image (PIL.UnidentifiedImageError) or a truncated one.
+        print(f"Failed to decode image from {image_url}: {e}")
+        image_path = None
+    except BrokenProcessPool as e:
+        # A worker died (e.g. killed when out of memory): the next downloads
+        # get a new pool.
+        print(f"Image worker died while encoding {image_url}: {e}")
+        replace_executor(pool)
+        image_path = None
+
+    if not image_path:
+        fetch_stats["failures"] += 1
+        return None
+
+    # Every book that waited on this download is flagged, including the
+    # ones that joined while the previous update ran.
+    updated = set()
+    async with acquire_connection() as conn:
+        while book_ids - updated:
+            pending = sorted(book_ids - updated)
+            await conn.execute(
+                f"UPDATE {TABLE_NAME} SET utils = jsonb_set(utils, '{{image_downloaded}}', 'true') WHERE id = ANY($1::text[])",
+                pending
+            )
+            updated.update(pending)
+    return image_path
+
+
+async def fetch_image_once(book_id, image_url, image_path):
+    entry = inflight.get(image_path)
+    if entry is None:
+        book_ids = {book_id}
+        task = asyncio.ensure_future(
+            download_image(book_ids, image_url, image_path))
+        inflight[image_path] = (task, book_ids)
+        task.add_done_callback(lambda _: inflight.pop(image_path, None))
+    else:
+        task, book_ids = entry
+        book_ids.add(book_id)
+        fetch_stats["coalesced"] += 1
+    # A client hanging up must not cancel the download other clients wait on.
+    return await asyncio.shield(task)
+
+
+def get_image_fetch_stats():
+    return dict(fetch_stats, inflight=len(inflight))
@@ -1,7 +1,31 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from expose.routes import router
+from expose.metrics import MetricsMiddleware
+from expose.database import init_pool, close_pool
+from expose.cache import start_cache_listener, stop_cache_listener, on_vectors_version
+from expose.memory_engine import reload_memory_engine
+from expose.semantic import load_query_encoder
+from expose.config import SEMANTIC_PRELOAD
+from expose.image_fetcher import start_image_fetcher, stop_image_fetcher
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    await init_pool()
+    await start_cache_listener()
+    await reload_memory_engine()
+    on_vectors_version(reload_memory_engine)
+    await start_image_fetcher()
+    if SEMANTIC_PRELOAD:
+        await load_query_encoder()
+    yield
+    await stop_image_fetcher()
+    await stop_cache_listener()
+    await close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(router)
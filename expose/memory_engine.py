@@ -0,0 +1,101 @@
+import asyncio
+import numpy as np
+from microservices.utils.snapshot import snapshot_paths, read_snapshot_pointer, FILTER_COLUMNS
+
+CHUNK_SIZE = 65536
+
+
+class MemoryEngine:
+    def __init__(self, name):
+        self.name = name
+        matrix_path, metadata_path = snapshot_paths(name)
+        self.matrix = np.load(matrix_path, mmap_mode='r')
+        with np.load(metadata_path) as metadata:
+            self.ids = metadata['ids']
+            self.norms = metadata['norms']
+            self.lists = metadata['lists']
+            self.centroids = metadata['centroids']
+            self.codes = {column: metadata[column] for column in FILTER_COLUMNS}
+        self.index = {book_id: i for i, book_id in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, vectors, norms, query, query_norm, method):
+        if method == "cosine":
+            denominator = norms * query_norm
+            denominator[denominator == 0] = 1
+            return 1 - (vectors @ query) / denominator
+        if method == "euclidean":
+            squared = norms ** 2 - 2 * (vectors @ query) + query_norm ** 2
+            return np.sqrt(np.maximum(squared, 0))
+        if method == "taxicab":
+            return np.abs(vectors - query).sum(axis=1)
+        raise ValueError(f"Unknown method {method}")
+
+    def probe_lists(self, query, query_norm, method, probes):
+        centroid_norms = np.linalg.norm(self.centroids, axis=1)
+        distances = self.distances(
+            self.centroids, centroid_norms, query, query_norm, method)
+        return np.argsort(distances)[:probes]
+
+    def search(self, book_id, method, filters, fast, k=5, probes=None):
+        position = self.index.get(book_id)
+        if position is None:
+            return []
+
+        mask = np.ones(len(self), dtype=bool)
+        for column in filters:
+            code = self.codes[column][position]
+            # A NULL value never matches, like `column = NULL` in SQL.
+            mask &= (self.codes[column] == code) if code >= 0 else False
+        if fast and self.codes['cluster'][position] >= 0:
+            mask &= self.codes['cluster'] == self.codes['cluster'][position]
+
+        query = np.asarray(self.matrix[position], dtype=np.float32)
+        return self.search_vector(query, method, mask, k, probes, self.norms[position])
+
+    def search_vector(self, query, method, mask=None, k=5, probes=None, query_norm=None):
+        query = np.asarray(query, dtype=np.float32)
+        if query_norm is None:
+            query_norm = np.linalg.norm(query)
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        if probes is not None:
+            mask &= np.isin(self.lists, self.probe_lists(
+                query, query_norm, method, probes))
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            return []
+
+        distances = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), CHUNK_SIZE):
+            chunk = candidates[start:start + CHUNK_SIZE]
+            distances[start:start + len(chunk)] = self.distances(
+                self.matrix[chunk], self.norms[chunk], query, query_norm, method)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return self.ids[candidates[top]].tolist()
+
+
+engine = None
+
+
+async def reload_memory_engine(version=None):
+    global engine
+    pointer = read_snapshot_pointer()
+    if pointer is None or (engine is not None and engine.name == pointer['name']):
+        return engine
+    # Load the new snapshot fully before swapping, requests keep using the
+    # previous engine meanwhile.
+    new_engine = await asyncio.to_thread(MemoryEngine, pointer['name'])
+    engine = new_engine
+    print(f"Memory engine loaded snapshot {engine.name} ({len(engine)} rows).")
+    return engine
+
+
+def get_memory_engine():
+    return engine
@@ -0,0 +1,208 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from starlette.datastructures import MutableHeaders
+from expose.config import METRICS_TIMING_HEADER
+from expose.admission import RESULTS as ADMISSION_RESULTS
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+STAGES = ("pool_wait", "db", "serialize")
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.stages = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.rows = defaultdict(lambda: Histogram(ROWS_BUCKETS))
+        self.cache = defaultdict(int)
+
+    def observe(self, route, method, status, duration, timings):
+        self.requests[(route, method, status)] += 1
+        self.latency[(route, method)].observe(duration)
+        for stage in STAGES:
+            self.stages[(route, stage)].observe(timings[stage])
+        if timings["rows"] is not None:
+            self.rows[route].observe(timings["rows"])
+        for result in ("hit", "miss"):
+            if timings[f"cache_{result}"]:
+                self.cache[(route, result)] += timings[f"cache_{result}"]
+
+    def render(self, pool_stats, admission_stats):
+        lines = [
+            "# HELP http_requests_total Requests served, by route, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(
+                f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, until the response headers are sent.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (route, method), histogram in sorted(self.latency.items()):
+            lines += histogram.render("http_request_duration_seconds",
+                                      f'route="{route}",method="{method}"')
+
+        lines += [
+            "# HELP http_request_stage_seconds Time spent per request waiting for the pool, in queries and serialising.",
+            "# TYPE http_request_stage_seconds histogram",
+        ]
+        for (route, stage), histogram in sorted(self.stages.items()):
+            lines += histogram.render("http_request_stage_seconds",
+                                      f'route="{route}",stage="{stage}"')
+
+        lines += [
+            "# HELP http_response_rows Books returned per response.",
+            "# TYPE http_response_rows histogram",
+        ]
+        for route, histogram in sorted(self.rows.items()):
+            lines += histogram.render("http_response_rows", f'route="{route}"')
+
+        lines += [
+            "# HELP similar_cache_requests_total Similarity cache lookups, by result.",
+            "# TYPE similar_cache_requests_total counter",
+        ]
+        for (route, result), count in sorted(self.cache.items()):
+            lines.append(
+                f'similar_cache_requests_total{{route="{route}",result="{result}"}} {count}')
+
+        lines += [
+            "# HELP admission_requests_total Expensive searches admitted, shed, timed out or degraded, by limiter.",
+            "# TYPE admission_requests_total counter",
+        ]
+        for limiter, stats in sorted(admission_stats.items()):
+            for result in ADMISSION_RESULTS:
+                lines.append(
+                    f'admission_requests_total{{limiter="{limiter}",result="{result}"}} {stats[result]}')
+        for name, key in (("admission_active", "active"), ("admission_waiting", "waiting")):
+            lines.append(f"# TYPE {name} gauge")
+            for limiter, stats in sorted(admission_stats.items()):
+                lines.append(f'{name}{{limiter="{limiter}"}} {stats[key]}')
+
+        for name, key, kind in (
+            ("db_pool_size", "size", "gauge"),
+            ("db_pool_idle", "idle", "gauge"),
+            ("db_pool_in_use", "in_use", "gauge"),
+            ("db_pool_acquired_total", "acquired", "counter"),
+            ("db_pool_timeouts_total", "timeouts", "counter"),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {pool_stats[key]}")
+
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+def new_timings():
+    return {
+        "pool_wait": 0.0,
+        "db": 0.0,
+        "serialize": 0.0,
+        "rows": None,
+        "cache_hit": 0,
+        "cache_miss": 0,
+    }
+
+
+def record(stage, duration):
+    timings = current_timings.get()
+    if timings is not None:
+        timings[stage] += duration
+
+
+def record_rows(count):
+    timings = current_timings.get()
+    if timings is not None:
+        timings["rows"] = (timings["rows"] or 0) + count
+
+
+def record_cache(hit):
+    timings = current_timings.get()
+    if timings is not None:
+        timings["cache_hit" if hit else "cache_miss"] += 1
+
+
+def record_query(logged_query):
+    # asyncpg query logger, installed on every pooled connection. It runs
+    # through call_soon with a copy of the request context, which still holds
+    # the timings dict of the request that ran the query.
+    record("db", logged_query.elapsed)
+
+
+def route_label(scope):
+    # Route templates keep the label cardinality bounded, unlike raw paths.
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def server_timing(timings, total):
+    stages = [f"{stage};dur={timings[stage] * 1000:.1f}" for stage in STAGES]
+    return ", ".join(stages + [f"total;dur={total * 1000:.1f}"])
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = new_timings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        duration = None
+
+        async def send_with_timings(message):
+            nonlocal status, duration
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                duration = time.perf_counter() - started
+                if METRICS_TIMING_HEADER:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", server_timing(timings, duration))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            current_timings.reset(token)
+            if duration is None:
+                duration = time.perf_counter() - started
+            request_metrics.observe(
+                route_label(scope), scope["method"], status, duration, timings)
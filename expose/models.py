@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
@@ -20,3 +20,29 @@ class Book(BaseModel):
     width: Optional[float] = None
     height: Optional[float] = None
     depth: Optional[float] = None
+
+
+class SimilarBatchRequest(BaseModel):
+    ids: List[str]
+    method: Optional[str] = "cosine"
+    author: Optional[bool] = False
+    collection: Optional[bool] = False
+    editeur: Optional[bool] = False
+    format: Optional[bool] = False
+    fast: Optional[bool] = False
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1, le=1000)
+
+
+class BasketRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1)
+    weights: Optional[List[float]] = None
+    method: Optional[str] = "cosine"
+    author: Optional[bool] = False
+    collection: Optional[bool] = False
+    editeur: Optional[bool] = False
+    format: Optional[bool] = False
+    fast: Optional[bool] = False
+    limit: Optional[int] = Field(5, ge=1, le=50)
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1, le=1000)
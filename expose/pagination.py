@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import date
+from fastapi import HTTPException
+
+KEYSET_ORDERS = {
+    "id": ["id"],
+    "date_de_parution": ["date_de_parution", "id"],
+}
+
+
+def encode_cursor(order_by, row):
+    values = []
+    for column in KEYSET_ORDERS[order_by]:
+        value = row[column]
+        values.append(value.isoformat() if isinstance(value, date) else value)
+    payload = json.dumps({"o": order_by, "k": values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        order_by = payload["o"]
+        values = payload["k"]
+        if order_by not in KEYSET_ORDERS or len(values) != len(KEYSET_ORDERS[order_by]):
+            raise ValueError("Unknown cursor order")
+        if order_by == "date_de_parution" and values[0] is not None:
+            values[0] = date.fromisoformat(values[0])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return order_by, values
+
+
+def build_keyset_clause(order_by, values, first_param):
+    # Returns the seek conditions, their parameters and the ORDER BY. Each
+    # condition is a plain range on the index, so every page seeks to the
+    # cursor; with two conditions, each one is an ordered, limited branch and
+    # the second is only walked once the first runs out.
+    if order_by == "id":
+        if values is None:
+            return [None], [], "ORDER BY id"
+        return [f"id > ${first_param}"], [values[0]], "ORDER BY id"
+
+    # NULL dates are served last and walked by id once the cursor reaches them.
+    order = "ORDER BY date_de_parution ASC NULLS LAST, id ASC"
+    if values is None:
+        return [None], [], order
+
+    last_date, last_id = values
+    if last_date is None:
+        return [f"date_de_parution IS NULL AND id > ${first_param}"], [last_id], order
+
+    conditions = [
+        f"(date_de_parution, id) > (${first_param}, ${first_param + 1})",
+        "date_de_parution IS NULL",
+    ]
+    return conditions, [last_date, last_id], order
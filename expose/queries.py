@@ -0,0 +1,192 @@
+import json
+import time
+from collections import OrderedDict
+import asyncpg
+from expose.config import TABLE_NAME, SEARCH_CONFIG, QUERY_REGISTRY_SIZE
+from expose.metrics import record
+from expose.pagination import build_keyset_clause
+from expose.serializers import BOOK_SELECT
+from common.facets import FACETS_VIEW, FACET_COLUMNS, facet_counts_query
+
+SCAN_NODES = ("Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+def build_books_query(filters, order_by=None, cursor_values=None, page=1, page_size=10):
+    # Filters are sorted by column, so a combination always gives the same
+    # SQL text (and the same prepared statement) whatever the order in which
+    # the parameters were read.
+    columns = sorted(column for column, value in filters.items() if value is not None)
+    conditions = [f"{column} = ${index}" for index, column in enumerate(columns, 1)]
+    params = [filters[column] for column in columns]
+
+    query = f"SELECT {BOOK_SELECT} FROM {TABLE_NAME}"
+    if order_by is None:
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}"
+        params.append(page_size)
+        params.append((page - 1) * page_size)
+    else:
+        seeks, keyset_params, order_clause = build_keyset_clause(
+            order_by, cursor_values, len(params) + 1)
+        params.extend(keyset_params)
+        limit = f"LIMIT ${len(params) + 1}"
+        params.append(page_size)
+
+        branches = []
+        for seek in seeks:
+            where = conditions + ([seek] if seek else [])
+            branch = query
+            if where:
+                branch += " WHERE " + " AND ".join(where)
+            branches.append(f"{branch} {order_clause} {limit}")
+        if len(branches) == 1:
+            query = branches[0]
+        else:
+            query = " UNION ALL ".join(f"({branch})" for branch in branches)
+            query += f" {order_clause} {limit}"
+
+    label = "books:" + (",".join(columns) or "-")
+    if order_by is not None:
+        label += f":order={order_by}"
+        if cursor_values is not None:
+            # The dated and undated phases of a date cursor are different SQL.
+            undated = order_by == "date_de_parution" and cursor_values[0] is None
+            label += ":cursor" + (":undated" if undated else "")
+    return label, query, params
+
+
+def top_facet_values(source):
+    # $1 holds the facet names (with 'total'), $2 the number of values of each.
+    return f"""
+        SELECT f.facet, v.value, v.count
+        FROM unnest($1::text[]) AS f(facet)
+        CROSS JOIN LATERAL (
+            SELECT value, count FROM {source}
+            WHERE facet = f.facet
+            ORDER BY count DESC, value
+            LIMIT $2
+        ) v
+    """
+
+
+def build_facets_query(facets, filters, q=None):
+    # Without scope, the counts are read from the materialised view; a scope
+    # counts the matching books only, in a single pass over them.
+    columns = sorted(column for column, value in filters.items() if value is not None)
+    if not columns and q is None:
+        return "facets:-", top_facet_values(FACETS_VIEW), []
+
+    conditions = [f"{column} = ${index}" for index, column in enumerate(columns, 3)]
+    params = [filters[column] for column in columns]
+    if q is not None:
+        conditions.append(
+            f"search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', ${len(params) + 3})")
+        params.append(q)
+
+    query = f"""
+        WITH scoped AS MATERIALIZED (
+            SELECT {", ".join(FACET_COLUMNS)}, labels FROM {TABLE_NAME}
+            WHERE {" AND ".join(conditions)}
+        ), counts AS (
+            {facet_counts_query("scoped", facets)}
+        )
+        {top_facet_values("counts")}
+    """
+    label = "facets:" + ",".join(columns + (["q"] if q is not None else [])) + ":" + ",".join(sorted(facets))
+    return label, query, params
+
+
+def plan_summary(plan):
+    scans = []
+
+    def walk(node):
+        if node.get("Node Type") in SCAN_NODES:
+            scans.append({"node": node["Node Type"], "index": node.get("Index Name")})
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan["Plan"])
+    return {
+        "uses_index": any(scan["index"] is not None for scan in scans),
+        "seq_scan": any(scan["node"] == "Seq Scan" for scan in scans),
+        "scans": scans,
+        "estimated_cost": plan["Plan"].get("Total Cost"),
+    }
+
+
+class QueryRegistry:
+    def __init__(self, size=QUERY_REGISTRY_SIZE):
+        self.size = size
+        self.statements = {}
+        self.shapes = {}
+        self.prepares = 0
+
+    def attach(self, conn):
+        # Called for every new pooled connection: the statements of a closed
+        # connection are dropped, and a reused backend pid starts empty.
+        pid = conn.get_server_pid()
+        self.statements[pid] = OrderedDict()
+        conn.add_termination_listener(lambda _: self.statements.pop(pid, None))
+
+    async def prepare(self, conn, statements, query):
+        statement = await conn.prepare(query)
+        statements[query] = statement
+        if len(statements) > self.size:
+            statements.popitem(last=False)
+        self.prepares += 1
+        return statement
+
+    async def fetch(self, conn, label, query, *params):
+        statements = self.statements.setdefault(conn.get_server_pid(), OrderedDict())
+        started = time.perf_counter()
+        statement = statements.get(query)
+        if statement is None:
+            statement = await self.prepare(conn, statements, query)
+        else:
+            statements.move_to_end(query)
+
+        try:
+            rows = await statement.fetch(*params)
+        except (asyncpg.exceptions.InvalidCachedStatementError, asyncpg.exceptions.OutdatedSchemaCacheError):
+            # The table changed since the statement was prepared (e.g. a new
+            # index column): prepare it again once.
+            statement = await self.prepare(conn, statements, query)
+            rows = await statement.fetch(*params)
+        elapsed = time.perf_counter() - started
+        # Prepared statements bypass the query logger of the pool.
+        record("db", elapsed)
+
+        shape = self.shapes.get(label)
+        if shape is None:
+            shape = self.shapes[label] = {
+                "query": query, "params": params, "calls": 0, "time": 0.0, "rows": 0}
+        shape["calls"] += 1
+        shape["time"] += elapsed
+        shape["rows"] += len(rows)
+        return rows
+
+    async def explain(self, conn, label):
+        shape = self.shapes[label]
+        plan = await conn.fetchval(
+            f"EXPLAIN (FORMAT JSON) {shape['query']}", *shape["params"])
+        return plan_summary(json.loads(plan)[0])
+
+    def stats(self, top=20):
+        shapes = sorted(self.shapes.items(), key=lambda item: item[1]["calls"], reverse=True)
+        return {
+            "connections": len(self.statements),
+            "prepared": sum(len(statements) for statements in self.statements.values()),
+            "prepares": self.prepares,
+            "shapes": len(self.shapes),
+            "hot": [{
+                "shape": label,
+                "calls": shape["calls"],
+                "time_total": shape["time"],
+                "time_avg": shape["time"] / shape["calls"],
+                "rows_avg": shape["rows"] / shape["calls"],
+            } for label, shape in shapes[:top]],
+        }
+
+
+query_registry = QueryRegistry()
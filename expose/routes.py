@@ -1,16 +1,67 @@
-import aiohttp
+import asyncio
 import os
 import json
-from fastapi import APIRouter, Query, HTTPException
-from typing import List, Optional
-from fastapi.responses import FileResponse
-from expose.models import Book
-from expose.database import get_db_connection
-from expose.config import TABLE_NAME
-from microservices.images import generate_image_path, download_and_save_image_webp
+import time
+import asyncpg
+import numpy as np
+from fastapi import APIRouter, Query, HTTPException, Request, Response
+from typing import Dict, List, Optional
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from expose.models import Book, SimilarBatchRequest, BasketRequest
+from expose.database import acquire_connection, get_pool_stats
+from expose.cache import similar_cache
+from expose.pagination import KEYSET_ORDERS, encode_cursor, decode_cursor
+from expose.queries import build_books_query, build_facets_query, query_registry
+from expose.serializers import BOOK_SELECT, BooksResponse, book_select, encode_books
+from expose.export import export_columns, encode_ndjson, ArrowStreamEncoder
+from expose.config import TABLE_NAME, SEARCH_CONFIG, SIMILAR_BATCH_MAX_IDS, EXPORT_BATCH_SIZE, IMAGE_CACHE_MAX_AGE, HYBRID_CANDIDATES, SIMILAR_PRECOMPUTED, SIMILAR_STATEMENT_TIMEOUT
+from expose.admission import Overloaded, limiters, get_admission_stats
+from expose.hybrid import FEATURE_SELECT, hybrid_weights, vector_matrix, rerank as rerank_candidates
+from expose.memory_engine import get_memory_engine
+from expose.metrics import request_metrics
+from expose.semantic import QueryEncoderUnavailable, get_query_embedding, get_semantic_cache_stats
+from expose.image_fetcher import fetch_image_once, get_image_fetch_stats
+from expose.http_cache import file_validators, is_not_modified
+from microservices.utils.neighbors import NEIGHBORS_TABLE
+from common.facets import FACETS
+from microservices.images import generate_image_path, variant_path, IMAGE_SIZES, DEFAULT_IMAGE_SIZE
 
 router = APIRouter()
 
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+SIMILARITY_ENGINES = ("postgres", "memory")
+
+DISTANCE_OPERATORS = {
+    "euclidean": "<->",
+    "cosine": "<=>",
+    "taxicab": "<+>",
+}
+
+
+async def fetch_tuned(conn, query, *params, ef_search=None, probes=None, label=None, statement_timeout=None):
+    if label is not None:
+        fetch = lambda: query_registry.fetch(conn, label, query, *params)
+    else:
+        fetch = lambda: conn.fetch(query, *params)
+
+    if ef_search is None and probes is None and not statement_timeout:
+        return await fetch()
+
+    # SET LOCAL only lasts for the current transaction, so the setting
+    # never leaks to the next request served by this pooled connection.
+    async with conn.transaction():
+        if statement_timeout:
+            await conn.execute(f"SET LOCAL statement_timeout = {int(statement_timeout)}")
+        if ef_search is not None:
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+        if probes is not None:
+            await conn.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+        return await fetch()
+
 
 @router.get("/books", response_model=List[Book])
 async def get_books(
@@ -36,16 +87,14 @@ async def get_books(
     width: Optional[float] = Query(None, description="Filter by width"),
     height: Optional[float] = Query(None, description="Filter by height"),
     depth: Optional[float] = Query(None, description="Filter by depth"),
-    page: Optional[int] = Query(1, description="Page number"),
+    page: Optional[int] = Query(1, ge=1, description="Page number"),
     page_size: Optional[int] = Query(
-        10, description="Number of items per page")
+        10, ge=1, description="Number of items per page"),
+    order_by: Optional[str] = Query(
+        None, description="Enable cursor pagination ordered by 'id' or 'date_de_parution'"),
+    cursor: Optional[str] = Query(
+        None, description="Cursor returned in the X-Next-Cursor header of the previous page")
 ):
-    conn = await get_db_connection()
-
-    query = f"SELECT * FROM {TABLE_NAME}"
-    params = []
-    conditions = []
-
     filters = {
         "id": id,
         "product_title": product_title,
@@ -66,6 +115,63 @@ async def get_books(
         "depth": depth,
     }
 
+    keyset = order_by is not None or cursor is not None
+    cursor_values = None
+    if keyset:
+        if cursor is not None:
+            cursor_order, cursor_values = decode_cursor(cursor)
+            if order_by is not None and order_by != cursor_order:
+                raise HTTPException(
+                    status_code=400, detail="Cursor does not match order_by")
+            order_by = cursor_order
+        elif order_by not in KEYSET_ORDERS:
+            raise HTTPException(
+                status_code=400, detail=f"order_by must be one of {', '.join(KEYSET_ORDERS)}")
+
+    label, query, params = build_books_query(
+        filters, order_by, cursor_values, page, page_size)
+
+    async with acquire_connection() as conn:
+        rows = await query_registry.fetch(conn, label, query, *params)
+
+    headers = {}
+    if keyset and rows and len(rows) == page_size:
+        headers["X-Next-Cursor"] = encode_cursor(order_by, rows[-1])
+
+    return BooksResponse(encode_books(rows), headers=headers)
+
+
+@router.get("/books/export")
+async def export_books(
+    output: Optional[str] = Query(
+        "ndjson", description="Output format (ndjson, arrow)"),
+    include_vectors: Optional[bool] = Query(
+        False, description="Include the embedding and tfidf vectors"),
+    author: Optional[str] = Query(None, description="Filter by author"),
+    collection: Optional[str] = Query(
+        None, description="Filter by collection"),
+    editeur: Optional[str] = Query(None, description="Filter by editor"),
+    format: Optional[str] = Query(None, description="Filter by format"),
+    presentation: Optional[str] = Query(
+        None, description="Filter by presentation")
+):
+    if output not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400, detail=f"output must be one of {', '.join(EXPORT_MEDIA_TYPES)}")
+
+    columns = export_columns(include_vectors)
+    query = f"SELECT {', '.join(columns)} FROM {TABLE_NAME}"
+    params = []
+    conditions = []
+
+    filters = {
+        "author": author,
+        "collection": collection,
+        "editeur": editeur,
+        "format": format,
+        "presentation": presentation,
+    }
+
     for column, value in filters.items():
         if value is not None:
             conditions.append(f"{column} = ${len(params) + 1}")
@@ -73,41 +179,139 @@ async def get_books(
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+
+    async def stream():
+        encoder = ArrowStreamEncoder(columns) if output == "arrow" else None
+        async with acquire_connection() as conn:
+            # Server-side cursors only live inside a transaction.
+            async with conn.transaction():
+                batch = []
+                async for row in conn.cursor(query, *params, prefetch=EXPORT_BATCH_SIZE):
+                    batch.append(row)
+                    if len(batch) >= EXPORT_BATCH_SIZE:
+                        yield encoder.encode(batch) if encoder else encode_ndjson(batch, columns)
+                        batch = []
+                if batch:
+                    yield encoder.encode(batch) if encoder else encode_ndjson(batch, columns)
+        if encoder:
+            yield encoder.close()
+
+    return StreamingResponse(stream(), media_type=EXPORT_MEDIA_TYPES[output])
+
+
+@router.get("/books/search", response_model=List[Book])
+async def search_books(
+    q: str = Query(..., min_length=1, description="Search text (web search syntax)"),
+    page: Optional[int] = Query(1, ge=1, description="Page number"),
+    page_size: Optional[int] = Query(
+        10, ge=1, le=100, description="Number of items per page")
+):
+    query = f"""
+        SELECT {BOOK_SELECT}
+        FROM {TABLE_NAME}, websearch_to_tsquery('{SEARCH_CONFIG}', $1) AS search_query
+        WHERE search_vector @@ search_query
+        ORDER BY ts_rank_cd(search_vector, search_query) DESC, id
+        LIMIT $2 OFFSET $3
+    """
+
+    async with acquire_connection() as conn:
+        rows = await conn.fetch(query, q, page_size, (page - 1) * page_size)
+
+    return BooksResponse(encode_books(rows))
+
+
+@router.get("/books/facets")
+async def get_book_facets(
+    facets: Optional[str] = Query(
+        ",".join(FACETS), description="Comma-separated facets (author, editeur, collection, format, labels)"),
+    limit: Optional[int] = Query(
+        20, ge=1, le=500, description="Number of values returned per facet"),
+    q: Optional[str] = Query(
+        None, min_length=1, description="Count only the books matching this search text"),
+    author: Optional[str] = Query(None, description="Count only the books of this author"),
+    editeur: Optional[str] = Query(None, description="Count only the books of this editor"),
+    collection: Optional[str] = Query(
+        None, description="Count only the books of this collection"),
+    format: Optional[str] = Query(None, description="Count only the books of this format"),
+    presentation: Optional[str] = Query(
+        None, description="Count only the books of this presentation")
+):
+    names = list(dict.fromkeys(name.strip() for name in facets.split(",") if name.strip()))
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"facets must be among {', '.join(FACETS)}")
 
-    offset = (page - 1) * page_size
-    query += f" LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}"
-    params.append(page_size)
-    params.append(offset)
-
-    print(f"Execute query : {query}")
+    filters = {
+        "author": author,
+        "editeur": editeur,
+        "collection": collection,
+        "format": format,
+        "presentation": presentation,
+    }
+    label, query, params = build_facets_query(names, filters, q)
 
-    rows = await conn.fetch(query, *params)
+    async with acquire_connection() as conn:
+        try:
+            rows = await query_registry.fetch(conn, label, query, names + ["total"], limit, *params)
+        except asyncpg.exceptions.UndefinedTableError:
+            raise HTTPException(
+                status_code=503, detail="Facet counts are not computed yet")
 
-    books = []
+    counts = {name: [] for name in names}
+    total = 0
     for row in rows:
-        book_data = {
-            "id": row['id'],
-            "product_title": row.get('product_title'),
-            "author": row.get('author'),
-            "resume": row.get('resume'),
-            "image_url": row.get('image_url'),
-            "collection": row.get('collection'),
-            "date_de_parution": str(row['date_de_parution']) if row.get('date_de_parution') is not None else '',
-            "ean": row.get('ean'),
-            "editeur": row.get('editeur'),
-            "format": row.get('format'),
-            "isbn": row.get('isbn'),
-            "nb_de_pages": row.get('nb_de_pages'),
-            "poids": float(row['poids']) if row.get('poids') is not None and -1e308 < float(row['poids']) < 1e308 else None,
-            "presentation": row.get('presentation'),
-            "width": float(row['width']) if row.get('width') is not None and -1e308 < float(row['width']) < 1e308 else None,
-            "height": float(row['height']) if row.get('height') is not None and -1e308 < float(row['height']) < 1e308 else None,
-            "depth": float(row['depth']) if row.get('depth') is not None and -1e308 < float(row['depth']) < 1e308 else None,
-        }
-        books.append(book_data)
+        if row['facet'] == "total":
+            total = row['count']
+        else:
+            counts[row['facet']].append({"value": row['value'], "count": row['count']})
+
+    return ORJSONResponse({"total": total, "scoped": bool(params), "facets": counts})
 
-    await conn.close()
-    return books
+
+@router.get("/books/semantic", response_model=List[Book])
+async def get_semantic_books(
+    q: str = Query(..., min_length=1,
+                   description="Free-text description of the wanted books"),
+    method: Optional[str] = Query(
+        "cosine", description="Distance used to rank books (taxicab, cosine, euclidean)"),
+    limit: Optional[int] = Query(
+        10, ge=1, le=50, description="Number of books returned"),
+    ef_search: Optional[int] = Query(
+        None, ge=1, le=1000, description="HNSW candidate list size (recall/speed trade-off)"),
+    probes: Optional[int] = Query(
+        None, ge=1, le=1000, description="Number of IVFFlat lists (or memory partitions) to probe"),
+    engine: Optional[str] = Query(
+        "postgres", description="Search engine (postgres, memory)")
+):
+    if method not in DISTANCE_OPERATORS:
+        raise HTTPException(
+            status_code=400, detail=f"method must be one of {', '.join(DISTANCE_OPERATORS)}")
+    if engine not in SIMILARITY_ENGINES:
+        raise HTTPException(
+            status_code=400, detail=f"engine must be one of {', '.join(SIMILARITY_ENGINES)}")
+
+    try:
+        embedding = await get_query_embedding(q)
+    except QueryEncoderUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    if engine == "memory":
+        memory_engine = get_memory_engine()
+        if memory_engine is None:
+            raise HTTPException(
+                status_code=503, detail="No embedding snapshot loaded")
+        ids = await asyncio.to_thread(
+            memory_engine.search_vector, embedding, method, None, limit, probes)
+        return BooksResponse(await fetch_books_by_ids(ids))
+
+    vector = '[' + ','.join(map(str, embedding)) + ']'
+    query = f"SELECT {BOOK_SELECT} FROM {TABLE_NAME} ORDER BY embedding {DISTANCE_OPERATORS[method]} $1 LIMIT $2"
+    async with acquire_connection() as conn:
+        rows = await fetch_tuned(conn, query, vector, limit, ef_search=ef_search, probes=probes)
+
+    return BooksResponse(encode_books(rows))
 
 
 @router.get("/books/{book_id}/similar", response_model=List[Book])
@@ -124,18 +328,140 @@ async def get_similar_books(
     format: Optional[bool] = Query(
         False, description="Filter by format"),
     fast: Optional[bool] = Query(
-        False, description="Search only within the same cluster")
+        False, description="Search only within the same cluster"),
+    ef_search: Optional[int] = Query(
+        None, ge=1, le=1000, description="HNSW candidate list size (recall/speed trade-off)"),
+    probes: Optional[int] = Query(
+        None, ge=1, le=1000, description="Number of IVFFlat lists to probe (recall/speed trade-off)"),
+    engine: Optional[str] = Query(
+        "postgres", description="Search engine (postgres, memory)"),
+    rerank: Optional[bool] = Query(
+        False, description="Re-rank a wider ANN candidate set with the hybrid weights")
 ):
-    conn = await get_db_connection()
-
-    query = f"SELECT *, utils->>'dynamic_cluster_number' as dynamic_cluster_number FROM {TABLE_NAME} WHERE id = $1"
-    book_details = await conn.fetchrow(query, book_id)
-
-    if not book_details:
-        await conn.close()
-        return []
-
-    book_embedding = book_details['embedding']
+    if engine not in SIMILARITY_ENGINES:
+        raise HTTPException(
+            status_code=400, detail=f"engine must be one of {', '.join(SIMILARITY_ENGINES)}")
+
+    weights = None
+    if rerank:
+        try:
+            weights = hybrid_weights.get()
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    cache_key = similar_cache.make_key(
+        book_id, method, author, collection, editeur, format, fast, ef_search, probes, engine,
+        hybrid_weights.mtime_ns if rerank else None)
+    similar_books = await similar_cache.get(cache_key)
+    if similar_books is not None:
+        return BooksResponse(similar_books)
+
+    fast_cache_key = similar_cache.make_key(
+        book_id, method, author, collection, editeur, format, True, ef_search, probes, engine,
+        hybrid_weights.mtime_ns if rerank else None)
+
+    if rerank:
+        timings = {}
+
+        async def fetch_hybrid(fast, fallback=False):
+            similar_books, stage_timings = await fetch_similar_books_hybrid(
+                book_id, method, author, collection, editeur, format, fast, ef_search, probes, engine, weights,
+                fallback)
+            timings.update(stage_timings)
+            return similar_books
+
+        if engine == "postgres":
+            similar_books, degraded = await fetch_admitted(fetch_hybrid, fast, fast_cache_key)
+        else:
+            similar_books, degraded = await fetch_hybrid(fast), None
+        headers = {"Server-Timing": server_timing(timings)} if timings else {}
+        if degraded:
+            headers["X-Degraded"] = degraded
+        else:
+            await similar_cache.set(cache_key, similar_books)
+        return BooksResponse(similar_books, headers=headers)
+
+    if (SIMILAR_PRECOMPUTED and engine == "postgres" and ef_search is None and probes is None
+            and not (author or collection or editeur or format or fast)):
+        similar_books = await fetch_precomputed_neighbors(book_id, method)
+
+    if similar_books is None:
+        if engine == "memory":
+            similar_books = await fetch_similar_books_memory(
+                book_id, method, author, collection, editeur, format, fast, probes)
+        else:
+            similar_books, degraded = await fetch_admitted(
+                lambda fast, fallback: fetch_similar_books(
+                    book_id, method, author, collection, editeur, format, fast, ef_search, probes, fallback),
+                fast, fast_cache_key)
+            if degraded:
+                return BooksResponse(similar_books, headers={"X-Degraded": degraded})
+    await similar_cache.set(cache_key, similar_books)
+    return BooksResponse(similar_books)
+
+
+def overloaded():
+    return HTTPException(
+        status_code=503, detail="Similarity search overloaded", headers={"Retry-After": "1"})
+
+
+async def fetch_admitted(fetch, fast, fast_cache_key):
+    # Runs a live search through the admission limiter of its kind. When the
+    # full search is shed or exceeds SIMILAR_STATEMENT_TIMEOUT, the request
+    # degrades to the cached or live cluster-restricted answer, which is
+    # cached under its own key so the full answer is computed again later.
+    # A book without cluster has no cheaper answer: it is shed with a 503.
+    if not fast:
+        try:
+            async with limiters["similar"].admit():
+                return await fetch(False), None
+        except (Overloaded, asyncpg.exceptions.QueryCanceledError):
+            limiters["similar"].degraded()
+
+        similar_books = await similar_cache.get(fast_cache_key)
+        if similar_books is not None:
+            return similar_books, "cache"
+
+    try:
+        async with limiters["similar_fast"].admit():
+            similar_books = await fetch(True, not fast)
+    except (Overloaded, asyncpg.exceptions.QueryCanceledError):
+        raise overloaded()
+
+    if fast:
+        return similar_books, None
+    await similar_cache.set(fast_cache_key, similar_books)
+    return similar_books, "fast"
+
+
+async def fetch_precomputed_neighbors(book_id, method):
+    # The vectorizer keeps the neighbours of every book in NEIGHBORS_TABLE;
+    # None means they are not available yet and the live query must run.
+    async with acquire_connection() as conn:
+        try:
+            rows = await conn.fetch(f"""
+                SELECT {book_select('b')}
+                FROM {NEIGHBORS_TABLE} n
+                JOIN {TABLE_NAME} b ON b.id = n.neighbor_id
+                WHERE n.book_id = $1 AND n.metric = $2
+                ORDER BY n.rank
+                LIMIT 4
+            """, book_id, method)
+        except asyncpg.exceptions.UndefinedTableError:
+            return None
+
+    if not rows:
+        return None
+    return encode_books(rows)
+
+
+def check_fallback(book_details, fallback):
+    # Without a cluster the "fast" search scans the whole catalogue, which
+    # is no fallback for a full search that was just shed.
+    if fallback and book_details.get('dynamic_cluster_number') is None:
+        raise Overloaded("no cluster to fall back on")
+
+
+def similar_conditions(book_details, author, collection, editeur, format, fast):
     cluster_label = book_details.get('dynamic_cluster_number')
 
     filters = {
@@ -146,7 +472,7 @@ async def get_similar_books(
     }
 
     conditions = []
-    params = [book_embedding]
+    params = [book_details['embedding']]
 
     for column, value in filters.items():
         if value:
@@ -158,59 +484,325 @@ async def get_similar_books(
             f"utils->>'dynamic_cluster_number' = ${len(params) + 1}")
         params.append(cluster_label)
 
-    base_query = f"SELECT * FROM {TABLE_NAME}"
-    if conditions:
-        base_query += " WHERE " + " AND ".join(conditions)
-
-    if method == "euclidean":
-        query = f"{base_query} ORDER BY embedding <-> $1 LIMIT 5"
-    elif method == "cosine":
-        query = f"{base_query} ORDER BY embedding <=> $1 LIMIT 5"
-    elif method == "taxicab":
-        query = f"{base_query} ORDER BY embedding <+> $1 LIMIT 5"
-    else:
-        await conn.close()
+    return conditions, params
+
+
+def server_timing(timings):
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in timings.items())
+
+
+async def fetch_similar_books(book_id, method, author, collection, editeur, format, fast, ef_search=None, probes=None,
+                              fallback=False):
+    async with acquire_connection() as conn:
+        query = f"SELECT *, utils->>'dynamic_cluster_number' as dynamic_cluster_number FROM {TABLE_NAME} WHERE id = $1"
+        book_details = await conn.fetchrow(query, book_id)
+
+        if not book_details:
+            return []
+
+        check_fallback(book_details, fallback)
+        conditions, params = similar_conditions(
+            book_details, author, collection, editeur, format, fast)
+
+        base_query = f"SELECT {BOOK_SELECT} FROM {TABLE_NAME}"
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
+
+        if method not in DISTANCE_OPERATORS:
+            return []
+        query = f"{base_query} ORDER BY embedding {DISTANCE_OPERATORS[method]} $1 LIMIT 5"
+
+        label = f"similar:{method}:" + (",".join(column for column, value in (
+            ("author", author), ("collection", collection), ("editeur", editeur), ("format", format)) if value) or "-")
+        if fast and book_details.get('dynamic_cluster_number') is not None:
+            label += ":fast"
+        rows = await fetch_tuned(conn, query, *params, ef_search=ef_search, probes=probes, label=label,
+                                 statement_timeout=SIMILAR_STATEMENT_TIMEOUT)
+
+    similar_books = encode_books(row for row in rows if row['id'] != book_id)
+
+    return similar_books
+
+
+async def fetch_similar_books_memory(book_id, method, author, collection, editeur, format, fast, probes=None):
+    memory_engine = get_memory_engine()
+    if memory_engine is None:
+        raise HTTPException(
+            status_code=503, detail="No embedding snapshot loaded")
+    if method not in DISTANCE_OPERATORS:
         return []
 
-    rows = await conn.fetch(query, *params)
+    filters = [column for column, value in {
+        "author": author,
+        "collection": collection,
+        "editeur": editeur,
+        "format": format,
+    }.items() if value]
+
+    ids = await asyncio.to_thread(
+        memory_engine.search, book_id, method, filters, fast, 5, probes)
+    ids = [similar_id for similar_id in ids if similar_id != book_id]
+    return await fetch_books_by_ids(ids)
+
+
+async def fetch_similar_books_hybrid(book_id, method, author, collection, editeur, format, fast,
+                                     ef_search=None, probes=None, engine="postgres", weights=None, fallback=False):
+    if method not in DISTANCE_OPERATORS:
+        return [], {}
+
+    timings = {}
+    started = time.perf_counter()
+    async with acquire_connection() as conn:
+        query = f"SELECT *, utils->>'dynamic_cluster_number' as dynamic_cluster_number FROM {TABLE_NAME} WHERE id = $1"
+        book_details = await conn.fetchrow(query, book_id)
+
+        if not book_details:
+            return [], timings
+        check_fallback(book_details, fallback)
+
+        if engine == "memory":
+            memory_engine = get_memory_engine()
+            if memory_engine is None:
+                raise HTTPException(
+                    status_code=503, detail="No embedding snapshot loaded")
+            filters = [column for column, value in {
+                "author": author,
+                "collection": collection,
+                "editeur": editeur,
+                "format": format,
+            }.items() if value]
+            ids = await asyncio.to_thread(
+                memory_engine.search, book_id, method, filters, fast, HYBRID_CANDIDATES + 1, probes)
+            rows = await conn.fetch(
+                f"SELECT {BOOK_SELECT}, {FEATURE_SELECT} FROM {TABLE_NAME} WHERE id = ANY($1::text[])", ids)
+            rows_by_id = {row['id']: row for row in rows}
+            rows = [rows_by_id[similar_id] for similar_id in ids if similar_id in rows_by_id]
+        else:
+            conditions, params = similar_conditions(
+                book_details, author, collection, editeur, format, fast)
+            query = f"SELECT {BOOK_SELECT}, {FEATURE_SELECT} FROM {TABLE_NAME}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY embedding {DISTANCE_OPERATORS[method]} $1 LIMIT {HYBRID_CANDIDATES + 1}"
+            rows = await fetch_tuned(conn, query, *params, ef_search=ef_search, probes=probes,
+                                     statement_timeout=SIMILAR_STATEMENT_TIMEOUT)
+    timings["ann"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    candidates = [row for row in rows if row['id'] != book_id]
+    ranked = await asyncio.to_thread(rerank_candidates, book_details, candidates, weights)
+    timings["rerank"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    similar_books = encode_books(ranked)
+    timings["serialize"] = time.perf_counter() - started
+
+    return similar_books, timings
+
+
+async def fetch_books_by_ids(ids):
+    if not ids:
+        return []
+
+    async with acquire_connection() as conn:
+        rows = await conn.fetch(f"SELECT {BOOK_SELECT} FROM {TABLE_NAME} WHERE id = ANY($1::text[])", ids)
+
+    rows_by_id = {row['id']: row for row in rows}
+    return encode_books(rows_by_id[book_id] for book_id in ids if book_id in rows_by_id)
+
+
+@router.post("/books/similar:batch", response_model=Dict[str, List[Book]])
+async def get_similar_books_batch(request: SimilarBatchRequest):
+    if request.method not in DISTANCE_OPERATORS:
+        raise HTTPException(
+            status_code=400, detail=f"method must be one of {', '.join(DISTANCE_OPERATORS)}")
+    if len(request.ids) > SIMILAR_BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {SIMILAR_BATCH_MAX_IDS} ids per batch")
+
+    options = (request.method, request.author, request.collection,
+               request.editeur, request.format, request.fast,
+               request.ef_search, request.probes)
+    results = {}
+    missing = []
+    for book_id in dict.fromkeys(request.ids):
+        cache_key = similar_cache.make_key(book_id, *options)
+        similar_books = await similar_cache.get(cache_key)
+        if similar_books is None:
+            missing.append(book_id)
+        else:
+            results[book_id] = similar_books
+
+    if missing:
+        try:
+            async with limiters["similar_batch"].admit():
+                fetched = await fetch_similar_books_batch(missing, *options)
+        except (Overloaded, asyncpg.exceptions.QueryCanceledError):
+            raise overloaded()
+        for book_id in missing:
+            similar_books = fetched.get(book_id, [])
+            await similar_cache.set(similar_cache.make_key(book_id, *options), similar_books)
+            results[book_id] = similar_books
+
+    return BooksResponse(results)
+
+
+async def fetch_similar_books_batch(book_ids, method, author, collection, editeur, format, fast, ef_search=None, probes=None):
+    filters = {
+        "author": author,
+        "collection": collection,
+        "editeur": editeur,
+        "format": format,
+    }
 
-    similar_books = []
+    conditions = [f"b.{column} = s.{column}" for column,
+                  value in filters.items() if value]
+    if fast:
+        conditions.append(
+            "(s.cluster IS NULL OR b.utils->>'dynamic_cluster_number' = s.cluster)")
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    query = f"""
+        SELECT s.id AS seed_id, n.*
+        FROM (
+            SELECT id, embedding, author, collection, editeur, format,
+                   utils->>'dynamic_cluster_number' AS cluster
+            FROM {TABLE_NAME}
+            WHERE id = ANY($1::text[])
+        ) s
+        CROSS JOIN LATERAL (
+            SELECT {book_select('b')} FROM {TABLE_NAME} b{where}
+            ORDER BY b.embedding {DISTANCE_OPERATORS[method]} s.embedding
+            LIMIT 5
+        ) n
+    """
+
+    async with acquire_connection() as conn:
+        rows = await fetch_tuned(conn, query, book_ids, ef_search=ef_search, probes=probes,
+                                 statement_timeout=SIMILAR_STATEMENT_TIMEOUT)
+
+    similar_books = {book_id: [] for book_id in book_ids}
     for row in rows:
-        if row['id'] != book_id:
-            book_data = {
-                "id": row['id'],
-                "product_title": row.get('product_title'),
-                "author": row.get('author'),
-                "resume": row.get('resume'),
-                "image_url": row.get('image_url'),
-                "collection": row.get('collection'),
-                "date_de_parution": str(row['date_de_parution']) if row.get('date_de_parution') is not None else '',
-                "ean": row.get('ean'),
-                "editeur": row.get('editeur'),
-                "format": row.get('format'),
-                "isbn": row.get('isbn'),
-                "nb_de_pages": row.get('nb_de_pages'),
-                "poids": float(row['poids']) if row.get('poids') is not None and -1e308 < float(row['poids']) < 1e308 else None,
-                "presentation": row.get('presentation'),
-                "width": float(row['width']) if row.get('width') is not None and -1e308 < float(row['width']) < 1e308 else None,
-                "height": float(row['height']) if row.get('height') is not None and -1e308 < float(row['height']) < 1e308 else None,
-                "depth": float(row['depth']) if row.get('depth') is not None and -1e308 < float(row['depth']) < 1e308 else None,
-            }
-            similar_books.append(book_data)
-
-    await conn.close()
+        if row['id'] != row['seed_id']:
+            similar_books[row['seed_id']].append(row)
+    for book_id, neighbours in similar_books.items():
+        similar_books[book_id] = encode_books(neighbours)
+
     return similar_books
 
 
+@router.post("/books/similar:basket", response_model=List[Book])
+async def get_basket_books(request: BasketRequest):
+    if request.method not in DISTANCE_OPERATORS:
+        raise HTTPException(
+            status_code=400, detail=f"method must be one of {', '.join(DISTANCE_OPERATORS)}")
+    if len(request.ids) > SIMILAR_BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {SIMILAR_BATCH_MAX_IDS} ids per basket")
+    if request.weights is not None:
+        if len(request.weights) != len(request.ids):
+            raise HTTPException(
+                status_code=400, detail="weights must have one value per id")
+        if min(request.weights) < 0 or sum(request.weights) <= 0:
+            raise HTTPException(
+                status_code=400, detail="weights must be non-negative with a positive sum")
+
+    weights = tuple(request.weights) if request.weights is not None else None
+    cache_key = similar_cache.make_key(
+        "basket:" + ",".join(request.ids), weights, request.method, request.author,
+        request.collection, request.editeur, request.format, request.fast,
+        request.limit, request.ef_search, request.probes)
+    similar_books = await similar_cache.get(cache_key)
+    if similar_books is not None:
+        return BooksResponse(similar_books)
+
+    try:
+        async with limiters["similar_basket"].admit():
+            similar_books = await fetch_basket_books(request)
+    except (Overloaded, asyncpg.exceptions.QueryCanceledError):
+        raise overloaded()
+    await similar_cache.set(cache_key, similar_books)
+    return BooksResponse(similar_books)
+
+
+def basket_centroid(seeds, weights, method):
+    # Cosine only depends on directions, so the seeds are normalised first and
+    # a long vector does not outweigh the others; the other distances average
+    # the raw vectors.
+    vectors = vector_matrix([seed['embedding'] for seed in seeds]).astype(np.float64)
+    if method == "cosine":
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    return np.average(vectors, axis=0, weights=weights)
+
+
+async def fetch_basket_books(request):
+    weights_by_id = dict(zip(request.ids, request.weights or [1.0] * len(request.ids)))
+
+    async with acquire_connection() as conn:
+        seeds = await conn.fetch(f"""
+            SELECT id, embedding, author, collection, editeur, format,
+                   utils->>'dynamic_cluster_number' AS cluster
+            FROM {TABLE_NAME}
+            WHERE id = ANY($1::text[]) AND embedding IS NOT NULL
+        """, request.ids)
+
+        weights = [weights_by_id[seed['id']] for seed in seeds]
+        if not seeds or sum(weights) <= 0:
+            return []
+
+        centroid = basket_centroid(seeds, weights, request.method)
+
+        # With several seeds, a filter keeps the books sharing the value of
+        # any of them, e.g. author=true recommends from every basket author.
+        filters = {
+            "author": request.author,
+            "collection": request.collection,
+            "editeur": request.editeur,
+            "format": request.format,
+        }
+        conditions = ["id <> ALL($2::text[])"]
+        params = ['[' + ','.join(map(str, centroid)) + ']', request.ids]
+        for column, value in filters.items():
+            if value:
+                conditions.append(f"{column} = ANY(${len(params) + 1}::text[])")
+                params.append(list({seed[column] for seed in seeds}))
+        if request.fast:
+            clusters = list({seed['cluster'] for seed in seeds if seed['cluster'] is not None})
+            if clusters:
+                conditions.append(
+                    f"utils->>'dynamic_cluster_number' = ANY(${len(params) + 1}::text[])")
+                params.append(clusters)
+
+        query = f"""
+            SELECT {BOOK_SELECT} FROM {TABLE_NAME}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY embedding {DISTANCE_OPERATORS[request.method]} $1
+            LIMIT {int(request.limit)}
+        """
+        rows = await fetch_tuned(conn, query, *params,
+                                 ef_search=request.ef_search, probes=request.probes,
+                                 statement_timeout=SIMILAR_STATEMENT_TIMEOUT)
+
+    return encode_books(rows)
+
+
 @router.get("/books/{book_id}/image", response_class=FileResponse)
-async def get_book_image(book_id: str):
-    conn = await get_db_connection()
+async def get_book_image(
+    book_id: str,
+    request: Request,
+    size: Optional[int] = Query(
+        DEFAULT_IMAGE_SIZE, description=f"Cover size in pixels ({', '.join(map(str, IMAGE_SIZES))})")
+):
+    if size not in IMAGE_SIZES:
+        raise HTTPException(
+            status_code=400, detail=f"size must be one of {', '.join(map(str, IMAGE_SIZES))}")
 
-    query = f"SELECT id, image_url, utils FROM {TABLE_NAME} WHERE id = $1"
-    book_details = await conn.fetchrow(query, book_id)
+    async with acquire_connection() as conn:
+        query = f"SELECT id, image_url, utils FROM {TABLE_NAME} WHERE id = $1"
+        book_details = await conn.fetchrow(query, book_id)
 
     if not book_details:
-        await conn.close()
         raise HTTPException(status_code=404, detail="Book not found")
 
     image_url = book_details['image_url']
@@ -220,18 +812,89 @@ async def get_book_image(book_id: str):
 
     image_path = generate_image_path(image_url)
 
-    if not os.path.exists(image_path) or not image_downloaded:
-        async with aiohttp.ClientSession() as session:
-            image_path = await download_and_save_image_webp(session, image_url, image_path)
-            if image_path:
-                await conn.execute(
-                    f"UPDATE {TABLE_NAME} SET utils = jsonb_set(utils, '{{image_downloaded}}', 'true') WHERE id = $1",
-                    book_id
-                )
-
-    if not os.path.exists(image_path):
-        await conn.close()
+    # Covers saved before size variants existed only have the default size.
+    if not os.path.exists(variant_path(image_path, size)) or not image_downloaded:
+        image_path = await fetch_image_once(book_id, image_url, image_path)
+
+    if not image_path or not os.path.exists(variant_path(image_path, size)):
         raise HTTPException(status_code=404, detail="Image not found")
 
-    await conn.close()
-    return FileResponse(image_path)
+    image_path = variant_path(image_path, size)
+    etag, last_modified, stat = file_validators(image_path)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}",
+    }
+
+    if is_not_modified(request.headers, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(image_path, media_type="image/webp", headers=headers, stat_result=stat)
+
+
+@router.get("/stats/pool")
+async def get_pool_statistics():
+    return get_pool_stats()
+
+
+@router.get("/stats/cache")
+async def get_cache_statistics():
+    return similar_cache.stats()
+
+
+@router.get("/stats/images")
+async def get_image_statistics():
+    return get_image_fetch_stats()
+
+
+@router.get("/stats/engine")
+async def get_engine_statistics():
+    memory_engine = get_memory_engine()
+    if memory_engine is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "snapshot": memory_engine.name,
+        "rows": len(memory_engine),
+        "dim": memory_engine.matrix.shape[1],
+        "lists": len(memory_engine.centroids),
+    }
+
+
+@router.get("/stats/semantic")
+async def get_semantic_statistics():
+    return get_semantic_cache_stats()
+
+
+@router.get("/stats/hybrid")
+async def get_hybrid_statistics():
+    return hybrid_weights.stats()
+
+
+@router.get("/stats/admission")
+async def get_admission_statistics():
+    return get_admission_stats()
+
+
+@router.get("/stats/queries")
+async def get_query_statistics(
+    top: Optional[int] = Query(20, ge=1, le=200, description="Number of shapes returned"),
+    explain: Optional[bool] = Query(
+        False, description="Add the plan summary of each shape (runs EXPLAIN)")
+):
+    stats = query_registry.stats(top)
+    if explain:
+        async with acquire_connection() as conn:
+            for shape in stats["hot"]:
+                try:
+                    shape["plan"] = await query_registry.explain(conn, shape["shape"])
+                except asyncpg.exceptions.PostgresError as e:
+                    shape["plan"] = {"error": str(e)}
+    return stats
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(
+        request_metrics.render(get_pool_stats(), get_admission_stats()), media_type="text/plain; version=0.0.4")
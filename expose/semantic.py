@@ -0,0 +1,77 @@
+import asyncio
+import importlib
+import re
+from functools import lru_cache
+from expose.config import SEMANTIC_CACHE_SIZE
+
+vectors = None
+model_version = (None, None)
+load_lock = asyncio.Lock()
+
+
+async def load_query_encoder():
+    # microservices.utils.vectors loads CamemBERT and the PCA model when it is
+    # imported, so the import is deferred until the first semantic query (or
+    # the startup preload) and then shared by every request of the worker.
+    global vectors
+    async with load_lock:
+        if vectors is None:
+            vectors = await asyncio.to_thread(
+                importlib.import_module, 'microservices.utils.vectors')
+            print("Loaded CamemBERT and PCA models for semantic queries.")
+    return vectors
+
+
+class QueryEncoderUnavailable(Exception):
+    pass
+
+
+def normalize_query(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+@lru_cache(maxsize=SEMANTIC_CACHE_SIZE)
+def embed_query(normalized_text, model_version):
+    # model_version is only part of the key: the vectors of a previous PCA
+    # are never read again and age out of the cache.
+    embedding = vectors.get_embedding(normalized_text)
+    embedding.setflags(write=False)
+    return embedding
+
+
+def current_model_version():
+    # The version hashes the PCA components, so it is computed once per
+    # loaded model.
+    global model_version
+    if model_version[0] is not vectors.pca:
+        model_version = (vectors.pca, vectors.embedding_model_version())
+    return model_version[1]
+
+
+def embed_current_query(normalized_text):
+    # The nightly retraining rewrites the PCA model (and the API may start
+    # before it exists): queries follow the file like the stored embeddings.
+    vectors.reload_models_if_changed()
+    if not hasattr(vectors.pca, 'components_'):
+        raise QueryEncoderUnavailable("PCA model not trained yet")
+    return embed_query(normalized_text, current_model_version())
+
+
+async def get_query_embedding(text):
+    normalized_text = normalize_query(text)
+    if vectors is None:
+        await load_query_encoder()
+    return await asyncio.to_thread(embed_current_query, normalized_text)
+
+
+def get_semantic_cache_stats():
+    info = embed_query.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "model_loaded": vectors is not None,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": info.hits / lookups if lookups else 0.0,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+    }
@@ -0,0 +1,46 @@
+import math
+import time
+from fastapi.responses import ORJSONResponse
+from expose.models import Book
+from expose.metrics import record, record_rows
+
+BOOK_COLUMNS = list(Book.model_fields)
+BOOK_SELECT = ", ".join(BOOK_COLUMNS)
+DECIMAL_COLUMNS = ("poids", "width", "height", "depth")
+
+
+def book_select(alias=None):
+    if alias is None:
+        return BOOK_SELECT
+    return ", ".join(f"{alias}.{column}" for column in BOOK_COLUMNS)
+
+
+def encode_books(rows):
+    # Rows are read with BOOK_SELECT, so the values are already of the Book
+    # types; only the DECIMAL columns and missing dates need converting.
+    # Dates are left to orjson, which writes them in ISO format like str().
+    started = time.perf_counter()
+    books = [{column: row[column] for column in BOOK_COLUMNS} for row in rows]
+    for column in DECIMAL_COLUMNS:
+        for book in books:
+            value = book[column]
+            if value is not None:
+                value = float(value)
+                book[column] = value if math.isfinite(value) else None
+    for book in books:
+        if book["date_de_parution"] is None:
+            book["date_de_parution"] = ''
+    record("serialize", time.perf_counter() - started)
+    return books
+
+
+class BooksResponse(ORJSONResponse):
+    def render(self, content):
+        started = time.perf_counter()
+        body = super().render(content)
+        record("serialize", time.perf_counter() - started)
+        if isinstance(content, dict):
+            record_rows(sum(len(books) for books in content.values()))
+        else:
+            record_rows(len(content))
+        return body
@@ -12,7 +12,8 @@ from sklearn.cluster import KMeans
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import silhouette_score
 from common.setup_mlflow_autolog import setup_mlflow_autolog
-from common.utils import reconnect, execute_batch_updates, TABLE_NAME
+from common.utils import reconnect, execute_batch_updates, bump_vectors_version, TABLE_NAME
+from microservices.utils.snapshot import publish_embedding_snapshot
 
 KMEANS_MODEL_PATH = 'data/models/kmeans_model.joblib'
 try:
@@ -131,6 +132,9 @@ async def labelize_new_rows(conn, recalculate_all=False):
 
     if updates:
         await execute_batch_updates(conn, updates, f"UPDATE {TABLE_NAME} SET utils = $1 WHERE id = $2")
+
+    await publish_embedding_snapshot(conn)
+    await bump_vectors_version(conn)
     print("Finished labeling new rows.")
 
 async def weekly_retrain_task(conn, lock, num_clusters=NUM_CLUSTERS):
@@ -10,6 +10,8 @@ from tqdm.asyncio import tqdm
 from common.utils import reconnect, execute_batch_updates, TABLE_NAME
 
 IMAGE_DIR = 'data/img'
+IMAGE_SIZES = (64, 128, 256)
+DEFAULT_IMAGE_SIZE = 256
 
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
@@ -21,27 +23,49 @@ async def fetch_image(session, url):
             print(f"Failed to fetch image from {url}")
             return None
 
-def standardize_image(image_data):
+def pad_image(image, size):
+    image = image.copy()
+    image.thumbnail((size, size))
+    new_image = Image.new("RGB", (size, size), (255, 255, 255))
+    new_image.paste(image, ((size - image.width) //
+                    2, (size - image.height) // 2))
+    return new_image
+
+def standardize_image(image_data, sizes=IMAGE_SIZES):
     image = Image.open(BytesIO(image_data))
     image = image.convert("RGB")
-    image.thumbnail((256, 256))
-    new_image = Image.new("RGB", (256, 256), (255, 255, 255))
-    new_image.paste(image, ((256 - image.width) //
-                    2, (256 - image.height) // 2))
-    return new_image
+    return {size: pad_image(image, size) for size in sizes}
 
-def generate_image_path(url):
+def generate_image_path(url, size=DEFAULT_IMAGE_SIZE):
     reversed_url = url[::-1]
     hash_object = hashlib.sha256(reversed_url.encode())
     hex_dig = hash_object.hexdigest()
-    return os.path.join(IMAGE_DIR, f"{hex_dig}.webp")
+    return variant_path(os.path.join(IMAGE_DIR, f"{hex_dig}.webp"), size)
 
-async def download_and_save_image_webp(session, url, image_path):
+def variant_path(image_path, size):
+    if size == DEFAULT_IMAGE_SIZE:
+        return image_path
+    root, ext = os.path.splitext(image_path)
+    return f"{root}_{size}{ext}"
+
+def save_image_webp(image_data, image_path):
+    # The default size is written last, so a cover is only seen as downloaded
+    # once all its variants exist.
+    variants = standardize_image(image_data)
+    for size in sorted(variants, key=lambda size: size == DEFAULT_IMAGE_SIZE):
+        path = variant_path(image_path, size)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        variants[size].save(tmp_path, format="WEBP", quality=85)
+        os.replace(tmp_path, path)
+    return image_path
+
+async def download_and_save_image_webp(session, url, image_path, executor=None):
     image_data = await fetch_image(session, url)
     if image_data:
-        image = standardize_image(image_data)
-        image.save(image_path, format="WEBP", quality=85)
-        return image_path
+        if executor is None:
+            return save_image_webp(image_data, image_path)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, save_image_webp, image_data, image_path)
     return None
 
 async def process_row(session, conn, row):
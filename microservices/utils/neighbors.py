@@ -0,0 +1,94 @@
+import os
+from common.utils import TABLE_NAME
+
+NEIGHBORS_TABLE = 'book_neighbors'
+NEIGHBORS_K = int(os.getenv('NEIGHBORS_K', 10))
+NEIGHBORS_BATCH_SIZE = 500
+NEIGHBOR_OPERATORS = {
+    "cosine": "<=>",
+    "euclidean": "<->",
+    "taxicab": "<+>",
+}
+
+
+async def create_neighbors_table(conn):
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {NEIGHBORS_TABLE} (
+            book_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            rank SMALLINT NOT NULL,
+            neighbor_id TEXT NOT NULL,
+            distance DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (book_id, metric, rank)
+        )
+    """)
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {NEIGHBORS_TABLE}_neighbor_id_idx ON {NEIGHBORS_TABLE} (neighbor_id)")
+
+
+async def refresh_neighbors(conn, book_ids):
+    # Each batch is replaced in its own transaction, so the API keeps serving
+    # the previous lists of the other books while the refresh runs.
+    for metric, operator in NEIGHBOR_OPERATORS.items():
+        for start in range(0, len(book_ids), NEIGHBORS_BATCH_SIZE):
+            batch = book_ids[start:start + NEIGHBORS_BATCH_SIZE]
+            async with conn.transaction():
+                await conn.execute(
+                    f"DELETE FROM {NEIGHBORS_TABLE} WHERE metric = $1 AND book_id = ANY($2::text[])", metric, batch)
+                await conn.execute(f"""
+                    INSERT INTO {NEIGHBORS_TABLE} (book_id, metric, rank, neighbor_id, distance)
+                    SELECT s.id, $1, row_number() OVER (PARTITION BY s.id ORDER BY n.distance), n.id, n.distance
+                    FROM {TABLE_NAME} s
+                    CROSS JOIN LATERAL (
+                        SELECT b.id, b.embedding {operator} s.embedding AS distance
+                        FROM {TABLE_NAME} b
+                        WHERE b.id <> s.id AND b.embedding IS NOT NULL
+                        ORDER BY b.embedding {operator} s.embedding
+                        LIMIT {NEIGHBORS_K}
+                    ) n
+                    WHERE s.id = ANY($2::text[]) AND s.embedding IS NOT NULL
+                """, metric, batch)
+
+
+async def drop_deleted_books(conn):
+    # Drops the lists of the books deleted from the catalogue, and returns
+    # the books whose list holds one of them, to be refreshed.
+    await conn.execute(
+        f"DELETE FROM {NEIGHBORS_TABLE} n WHERE NOT EXISTS (SELECT 1 FROM {TABLE_NAME} b WHERE b.id = n.book_id)")
+    rows = await conn.fetch(f"""
+        SELECT DISTINCT n.book_id FROM {NEIGHBORS_TABLE} n
+        WHERE NOT EXISTS (SELECT 1 FROM {TABLE_NAME} b WHERE b.id = n.neighbor_id)
+    """)
+    return {row['book_id'] for row in rows}
+
+
+async def update_neighbors(conn, changed_ids, recalculate_all=False, prune_deleted=False):
+    await create_neighbors_table(conn)
+
+    if recalculate_all:
+        await drop_deleted_books(conn)
+        rows = await conn.fetch(f"SELECT id FROM {TABLE_NAME} WHERE embedding IS NOT NULL")
+        book_ids = [row['id'] for row in rows]
+        await refresh_neighbors(conn, book_ids)
+        print(f"Rebuilt the top-{NEIGHBORS_K} neighbours of {len(book_ids)} books.")
+        return len(book_ids)
+
+    # Besides the changed books themselves, the lists to refresh are the ones
+    # a changed book appeared in (its distance changed) and the ones it may
+    # now enter. Distances are symmetric, so the latter are approximated by
+    # the new neighbours of the changed book.
+    rows = await conn.fetch(
+        f"SELECT DISTINCT book_id FROM {NEIGHBORS_TABLE} WHERE neighbor_id = ANY($1::text[])", changed_ids)
+    stale_ids = {row['book_id'] for row in rows}
+    if prune_deleted:
+        stale_ids |= await drop_deleted_books(conn)
+
+    await refresh_neighbors(conn, changed_ids)
+
+    rows = await conn.fetch(
+        f"SELECT DISTINCT neighbor_id FROM {NEIGHBORS_TABLE} WHERE book_id = ANY($1::text[])", changed_ids)
+    affected_ids = sorted((stale_ids | {row['neighbor_id'] for row in rows}) - set(changed_ids))
+
+    await refresh_neighbors(conn, affected_ids)
+    print(f"Refreshed the top-{NEIGHBORS_K} neighbours of {len(changed_ids)} changed and {len(affected_ids)} affected books.")
+    return len(changed_ids) + len(affected_ids)
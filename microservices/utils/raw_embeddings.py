@@ -0,0 +1,76 @@
+import fcntl
+import os
+import numpy as np
+
+RAW_EMBEDDINGS_DIR = os.getenv('RAW_EMBEDDINGS_DIR', 'data/embeddings')
+HASH_SIZE = 32
+
+
+class RawEmbeddingStore:
+    # Append-only store of the raw CamemBERT embeddings, keyed by the SHA-256
+    # of their input text: `embeddings.f32` holds the float32 rows and
+    # `hashes.bin` the digest of each row, in the same order. A row exists
+    # once its digest is written, so readers never see a partial vector.
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.vectors_path = os.path.join(path, 'embeddings.f32')
+        self.hashes_path = os.path.join(path, 'hashes.bin')
+        self.lock_path = os.path.join(path, 'append.lock')
+        self.index = {}
+        self.rows = 0
+        self.matrix = None
+
+    def __len__(self):
+        return self.refresh()
+
+    def refresh(self):
+        # Other processes (the vectorizer workers) append too: only the
+        # digests written since the last refresh are read.
+        size = os.path.getsize(self.hashes_path) if os.path.exists(self.hashes_path) else 0
+        rows = size // HASH_SIZE
+        if rows > self.rows:
+            with open(self.hashes_path, 'rb') as file:
+                file.seek(self.rows * HASH_SIZE)
+                data = file.read((rows - self.rows) * HASH_SIZE)
+            for offset in range(rows - self.rows):
+                self.index.setdefault(data[offset * HASH_SIZE:(offset + 1) * HASH_SIZE], self.rows + offset)
+            self.rows = rows
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self.rows
+
+    def lookup(self, hashes):
+        self.refresh()
+        return [self.index.get(bytes.fromhex(content_hash)) for content_hash in hashes]
+
+    def read(self, positions):
+        return np.asarray(self.matrix[positions], dtype=np.float32)
+
+    def append(self, hashes, vectors):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                new = {}
+                for position, content_hash in enumerate(hashes):
+                    key = bytes.fromhex(content_hash)
+                    if key not in self.index:
+                        new.setdefault(key, position)
+                if not new:
+                    return 0
+
+                # An interrupted append may have left vectors without their
+                # digest (or half a digest): both files are cut back to the
+                # last complete row first.
+                with open(self.vectors_path, 'ab') as file:
+                    file.truncate(self.rows * self.dim * 4)
+                    file.write(np.ascontiguousarray(
+                        vectors[list(new.values())], dtype=np.float32).tobytes())
+                with open(self.hashes_path, 'ab') as file:
+                    file.truncate(self.rows * HASH_SIZE)
+                    file.write(b''.join(new))
+                self.refresh()
+                return len(new)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,93 @@
+import os
+import json
+import glob
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sklearn.cluster import MiniBatchKMeans
+from common.utils import TABLE_NAME
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'data/snapshots')
+SNAPSHOT_POINTER_PATH = os.path.join(SNAPSHOT_DIR, 'current.json')
+SNAPSHOT_KEEP = 2
+SNAPSHOT_MIN_ROWS_FOR_LISTS = 1000
+FILTER_COLUMNS = ['author', 'collection', 'editeur', 'format', 'cluster']
+
+
+def snapshot_paths(name):
+    base = os.path.join(SNAPSHOT_DIR, name)
+    return f"{base}.npy", f"{base}.npz"
+
+
+def read_snapshot_pointer():
+    if not os.path.exists(SNAPSHOT_POINTER_PATH):
+        return None
+    with open(SNAPSHOT_POINTER_PATH, 'r') as file:
+        return json.load(file)
+
+
+def build_lists(matrix):
+    # Coarse partition of the vectors, probed by the memory engine for ANN search.
+    if len(matrix) < SNAPSHOT_MIN_ROWS_FOR_LISTS:
+        return np.zeros(len(matrix), dtype=np.int32), matrix.mean(axis=0, keepdims=True)
+    n_lists = int(np.sqrt(len(matrix)))
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=42, n_init=1)
+    lists = kmeans.fit_predict(matrix)
+    return lists.astype(np.int32), kmeans.cluster_centers_.astype(np.float32)
+
+
+def cleanup_snapshots(current_name):
+    names = sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(SNAPSHOT_DIR, 'embeddings-*.npy'))
+    )
+    # Engines still serving an older snapshot keep their mapping of a removed file.
+    for name in names[:-SNAPSHOT_KEEP]:
+        if name != current_name:
+            for path in snapshot_paths(name):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+async def publish_embedding_snapshot(conn):
+    query = f"""
+        SELECT id, embedding, author, collection, editeur, format,
+               utils->>'dynamic_cluster_number' AS cluster
+        FROM {TABLE_NAME}
+        WHERE embedding IS NOT NULL
+        ORDER BY id
+    """
+    rows = await conn.fetch(query)
+    if not rows:
+        print("No embeddings to snapshot.")
+        return None
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    matrix = np.ascontiguousarray(np.array(
+        [np.fromstring(row['embedding'][1:-1], sep=',') for row in rows], dtype=np.float32))
+    lists, centroids = build_lists(matrix)
+
+    metadata = {
+        "ids": np.array([row['id'] for row in rows]),
+        "norms": np.linalg.norm(matrix, axis=1).astype(np.float32),
+        "lists": lists,
+        "centroids": centroids,
+    }
+    for column in FILTER_COLUMNS:
+        codes, _ = pd.factorize(pd.Series([row[column] for row in rows], dtype=object))
+        metadata[column] = codes.astype(np.int32)
+
+    name = f"embeddings-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    matrix_path, metadata_path = snapshot_paths(name)
+    np.save(matrix_path, matrix)
+    np.savez(metadata_path, **metadata)
+
+    pointer = {"name": name, "rows": len(rows), "dim": int(matrix.shape[1])}
+    tmp_pointer_path = f"{SNAPSHOT_POINTER_PATH}.tmp"
+    with open(tmp_pointer_path, 'w') as file:
+        json.dump(pointer, file)
+    os.replace(tmp_pointer_path, SNAPSHOT_POINTER_PATH)
+
+    cleanup_snapshots(name)
+    print(f"Published embedding snapshot {name} with {len(rows)} rows.")
+    return name
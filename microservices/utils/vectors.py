@@ -1,4 +1,6 @@
+import hashlib
 import os
+import time
 import torch
 import numpy as np
 from sklearn.decomposition import PCA
@@ -8,12 +10,19 @@ from transformers import CamembertModel, CamembertTokenizer
 import joblib
 import mlflow
 from common.setup_mlflow_autolog import setup_mlflow_autolog
+from microservices.utils.raw_embeddings import RawEmbeddingStore, RAW_EMBEDDINGS_DIR
 from datetime import datetime
 
 MODEL_DIR = 'data/models'
 PCA_MODEL_PATH = os.path.join(MODEL_DIR, 'pca_model.joblib')
 TFIDF_MODEL_PATH = os.path.join(MODEL_DIR, 'tfidf_vectorizer.joblib')
 STOP_WORDS_PATH = 'data/stop_words_french.txt'
+EMBEDDING_DIM = 768
+EMBEDDING_MAX_LENGTH = 512
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+EMBEDDING_TOKEN_BUDGET = int(os.getenv('EMBEDDING_TOKEN_BUDGET', 8192))
+EMBEDDING_CHUNK_SIZE = int(os.getenv('EMBEDDING_CHUNK_SIZE', 1000))
+TFIDF_CHUNK_SIZE = int(os.getenv('TFIDF_CHUNK_SIZE', 5000))
 
 with open(STOP_WORDS_PATH, 'r', encoding='utf-8') as file:
     french_stop_words = [line.strip() for line in file]
@@ -38,6 +47,36 @@ if os.path.exists(TFIDF_MODEL_PATH):
 else:
     print("TF-IDF vectorizer not found; will train when needed.")
 
+# Raw embeddings only depend on the text and the transformer, so they are
+# kept per model and reused whatever the PCA.
+raw_store = RawEmbeddingStore(os.path.join(RAW_EMBEDDINGS_DIR, model_name), EMBEDDING_DIM)
+
+embedding_stats = {"texts": 0, "unique": 0, "batches": 0, "seconds": 0.0, "stored": 0}
+
+
+def model_mtime(path):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+model_mtimes = {PCA_MODEL_PATH: model_mtime(PCA_MODEL_PATH),
+                TFIDF_MODEL_PATH: model_mtime(TFIDF_MODEL_PATH)}
+
+
+def reload_models_if_changed():
+    # The trainings write the models to disk; long-lived processes (the
+    # vectorizer workers) follow them without reloading CamemBERT.
+    global pca, tfidf_vectorizer
+    for path in model_mtimes:
+        mtime = model_mtime(path)
+        if mtime is None or mtime == model_mtimes[path]:
+            continue
+        if path == PCA_MODEL_PATH:
+            pca = joblib.load(path)
+        else:
+            tfidf_vectorizer = joblib.load(path)
+        model_mtimes[path] = mtime
+        print(f"Reloaded {path}.")
+
 
 async def initialize_pca_model(conn, table_name):
     global pca
@@ -58,14 +97,8 @@ async def initialize_pca_model(conn, table_name):
                 print("No data found for PCA initialization.")
                 return
 
-            combined_texts = [f"{row['resume']} {row['product_title']}".strip()
-                              for row in rows]
-            embeddings = []
-            for text in tqdm(combined_texts, desc="Generating embeddings for PCA", unit="text"):
-                embedding = get_embedding(text, apply_pca=False)
-                embeddings.append(embedding)
-
-            embeddings_matrix = np.array(embeddings)
+            embeddings_matrix = embed_texts_in_chunks(
+                [embedding_text(row) for row in rows], "Generating embeddings for PCA")
             pca = PCA(n_components=128)
             pca.fit(embeddings_matrix)
             joblib.dump(pca, PCA_MODEL_PATH)
@@ -133,44 +166,195 @@ async def initialize_tfidf_model(conn, table_name):
         mlflow.log_param("end_time", end_time)
 
 
-def get_embedding(text, max_length=512, apply_pca=True):
-    inputs = tokenizer(text, return_tensors='pt',
-                       truncation=True, padding=True, max_length=max_length)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    embedding = outputs.last_hidden_state[:, 0, :].numpy()
-
-    if apply_pca:
-        if not hasattr(pca, 'components_'):
-            raise RuntimeError(
-                "PCA model is not initialized. Please run initialize_pca_model first.")
+def embedding_text(row):
+    return f"{row['resume']} {row['product_title']}".strip()
 
-        if embedding.shape[1] != 768:
-            raise ValueError(
-                f"Expected embedding size of 768, got {embedding.shape[1]}")
-
-        reduced_embedding = pca.transform(embedding)
-        return reduced_embedding.flatten()
-
-    return embedding.flatten()
 
+def apply_pca_model(embeddings):
+    if not hasattr(pca, 'components_'):
+        raise RuntimeError(
+            "PCA model is not initialized. Please run initialize_pca_model first.")
+
+    if embeddings.shape[1] != EMBEDDING_DIM:
+        raise ValueError(
+            f"Expected embedding size of {EMBEDDING_DIM}, got {embeddings.shape[1]}")
+
+    return pca.transform(embeddings)
+
+
+def length_buckets(lengths, batch_size=EMBEDDING_BATCH_SIZE, token_budget=EMBEDDING_TOKEN_BUDGET):
+    # Texts are taken by increasing length, so each batch is padded to
+    # about the length of its own texts. A batch is closed when it holds
+    # batch_size texts or when padding one more text (the longest so far)
+    # would exceed token_budget tokens.
+    batch = []
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[index] > token_budget):
+            yield batch
+            batch = []
+        batch.append(index)
+    if batch:
+        yield batch
+
+
+def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, token_budget=EMBEDDING_TOKEN_BUDGET,
+                   max_length=EMBEDDING_MAX_LENGTH, apply_pca=True, stats=embedding_stats):
+    started = time.perf_counter()
+    # Identical texts (reissues, empty summaries) are embedded once.
+    unique_texts = list(dict.fromkeys(texts))
+    input_ids = tokenizer(unique_texts, truncation=True, max_length=max_length)['input_ids']
+
+    embeddings = np.empty((len(unique_texts), EMBEDDING_DIM), dtype=np.float32)
+    batches = 0
+    for batch in length_buckets([len(ids) for ids in input_ids], batch_size, token_budget):
+        inputs = tokenizer.pad(
+            {'input_ids': [input_ids[index] for index in batch]}, return_tensors='pt')
+        with torch.no_grad():
+            outputs = model(**inputs)
+        embeddings[batch] = outputs.last_hidden_state[:, 0, :].numpy()
+        batches += 1
 
-def generate_tfidf_vector(column):
+    if apply_pca:
+        embeddings = apply_pca_model(embeddings)
+
+    positions = {text: index for index, text in enumerate(unique_texts)}
+    embeddings = embeddings[[positions[text] for text in texts]]
+
+    stats["texts"] += len(texts)
+    stats["unique"] += len(unique_texts)
+    stats["batches"] += batches
+    stats["seconds"] += time.perf_counter() - started
+    return embeddings
+
+
+def get_embedding(text, max_length=EMBEDDING_MAX_LENGTH, apply_pca=True):
+    return get_embeddings([text], max_length=max_length, apply_pca=apply_pca)[0]
+
+
+def get_raw_embeddings(texts, hashes=None, stats=embedding_stats):
+    # Raw (768-d) embeddings of the texts: read from the raw store when the
+    # text was embedded before, otherwise computed and appended to it.
+    if hashes is None:
+        hashes = [text_hash(text) for text in texts]
+    positions = raw_store.lookup(hashes)
+    stored = [index for index, position in enumerate(positions) if position is not None]
+    missing = [index for index, position in enumerate(positions) if position is None]
+
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    if stored:
+        embeddings[stored] = raw_store.read([positions[index] for index in stored])
+    if missing:
+        computed = get_embeddings([texts[index] for index in missing], apply_pca=False, stats=stats)
+        raw_store.append([hashes[index] for index in missing], computed)
+        embeddings[missing] = computed
+    stats["stored"] += len(stored)
+    return embeddings
+
+
+def embed_texts_in_chunks(texts, description):
+    # Chunks keep the progress bar moving and bound the memory of the
+    # tokenised texts, while leaving room for length bucketing.
+    reset_embedding_stats()
+    embeddings = []
+    for start in tqdm(range(0, len(texts), EMBEDDING_CHUNK_SIZE), desc=description, unit="chunk"):
+        embeddings.append(get_raw_embeddings(texts[start:start + EMBEDDING_CHUNK_SIZE]))
+    log_embedding_throughput()
+    return np.concatenate(embeddings) if embeddings else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+
+def reset_embedding_stats():
+    for key in embedding_stats:
+        embedding_stats[key] = 0
+
+
+def log_embedding_throughput(seconds=None):
+    # With several workers, the wall-clock time of the run is passed, as
+    # the per-worker times overlap.
+    seconds = embedding_stats["seconds"] if seconds is None else seconds
+    texts_per_second = embedding_stats["texts"] / seconds if seconds else 0.0
+    print(f"Embedded {embedding_stats['texts']} texts ({embedding_stats['unique']} unique, "
+          f"{embedding_stats['batches']} batches) in {seconds:.1f}s, {texts_per_second:.1f} texts/s; "
+          f"{embedding_stats['stored']} read from the raw embedding store.")
+    if mlflow.active_run() is not None:
+        mlflow.log_metric("embedding_texts_per_second", texts_per_second)
+        mlflow.log_metric("embedding_batches", embedding_stats["batches"])
+        mlflow.log_metric("embedding_unique_texts", embedding_stats["unique"])
+        mlflow.log_metric("embedding_store_hits", embedding_stats["stored"])
+
+
+def tfidf_vector_strings(texts):
+    # The chunk is transformed as one sparse matrix and only the non-zero
+    # values of each row are formatted.
     if not hasattr(tfidf_vectorizer, 'vocabulary_'):
         raise RuntimeError(
             "TF-IDF vectorizer is not fitted. Please run initialize_tfidf_model first.")
 
-    tfidf_matrix = tfidf_vectorizer.transform(column)
-    tfidf_vector = tfidf_matrix.toarray()[0]
-    return tfidf_vector
+    tfidf_matrix = tfidf_vectorizer.transform(texts).tocsr()
+    zeros = ['0'] * tfidf_matrix.shape[1]
+    vector_strings = []
+    for index in range(tfidf_matrix.shape[0]):
+        start, end = tfidf_matrix.indptr[index], tfidf_matrix.indptr[index + 1]
+        values = zeros.copy()
+        for column, value in zip(tfidf_matrix.indices[start:end], tfidf_matrix.data[start:end]):
+            values[column] = str(value)
+        vector_strings.append('[' + ','.join(values) + ']')
+    return vector_strings
 
 
-def generate_vectors_for_row(row):
-    embedding_text = f"{row['resume']} {row['product_title']}".strip()
-    embedding_vector = get_embedding(embedding_text)
-    combined_text = [row['resume'], row['product_title']]
-    tfidf_vector = generate_tfidf_vector(combined_text)
-    return embedding_vector, tfidf_vector
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def embedding_model_version():
+    # Identifies the transformer and the fitted PCA, so a retrained PCA
+    # makes every stored embedding stale.
+    if not hasattr(pca, 'components_'):
+        raise RuntimeError(
+            "PCA model is not initialized. Please run initialize_pca_model first.")
+    return f"{model_name}:{hashlib.sha256(pca.components_.tobytes()).hexdigest()[:16]}"
+
+
+def needs_embedding(row, content_hash, version):
+    return (not row['has_embedding'] or row['embedding_hash'] != content_hash
+            or row['embedding_version'] != version)
+
+
+def vectorize_rows(rows, refresh_tfidf=True):
+    # Runs in a vectorizer worker: returns the (embedding, tfidf, hash,
+    # version, id) update parameters of the rows, already formatted, the
+    # embedding counters of the chunk (counted apart from embedding_stats,
+    # which the caller adds them to) and the number of rows handled. The
+    # embedding is None when the stored one was computed from the same text
+    # with the same models: only the TF-IDF is refreshed, or the row is
+    # skipped without refresh_tfidf.
+    reload_models_if_changed()
+    stats = dict.fromkeys(embedding_stats, 0)
+    version = embedding_model_version()
+
+    texts = [embedding_text(row) for row in rows]
+    hashes = [text_hash(text) for text in texts]
+    stale = [index for index, row in enumerate(rows) if needs_embedding(row, hashes[index], version)]
+    embedding_vectors = {}
+    if stale:
+        # A text embedded before (e.g. when only the PCA changed) is read
+        # from the raw store and only projected again.
+        raw_embeddings = get_raw_embeddings(
+            [texts[index] for index in stale], [hashes[index] for index in stale], stats)
+        embedding_vectors = dict(zip(stale, apply_pca_model(raw_embeddings)))
+
+    selected = range(len(rows)) if refresh_tfidf else stale
+    tfidf_vectors = tfidf_vector_strings([rows[index]['resume'] for index in selected]) if selected else []
+
+    updates = []
+    for index, tfidf_vector_str in zip(selected, tfidf_vectors):
+        row = rows[index]
+        embedding_vector = embedding_vectors.get(index)
+        if embedding_vector is None:
+            updates.append((None, tfidf_vector_str, row['embedding_hash'], row['embedding_version'], row['id']))
+        else:
+            embedding_vector_str = '[' + ','.join(map(str, embedding_vector)) + ']'
+            updates.append((embedding_vector_str, tfidf_vector_str, hashes[index], version, row['id']))
+    return updates, stats, len(rows)
 
 
 async def retrain_tfidf_model(conn, table_name):
@@ -203,21 +387,17 @@ async def retrain_tfidf_model(conn, table_name):
 
 
 async def retrain_pca_model(conn, table_name):
+    global pca
     setup_mlflow_autolog(experiment_name="vectorizer_monitoring")
     start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     with mlflow.start_run(run_name="retrain_pca_model_run"):
         print("Starting PCA retraining with full dataset from database.")
         query = f"SELECT resume, product_title FROM {table_name}"
         rows = await conn.fetch(query)
-        combined_texts = [f"{row['resume']} {row['product_title']}".strip()
-                          for row in rows]
-
-        embeddings = []
-        for text in tqdm(combined_texts, desc="Generating embeddings for PCA retraining", unit="text"):
-            embedding = get_embedding(text)
-            embeddings.append(embedding)
-
-        embeddings_matrix = np.array(embeddings)
+        # PCA is fitted on the raw CamemBERT embeddings, not on the output
+        # of the previous model.
+        embeddings_matrix = embed_texts_in_chunks(
+            [embedding_text(row) for row in rows], "Generating embeddings for PCA retraining")
 
         pca = PCA(n_components=128)
         pca.fit(embeddings_matrix)
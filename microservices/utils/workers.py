@@ -0,0 +1,90 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+VECTORIZER_WORKERS = int(os.getenv('VECTORIZER_WORKERS', 0))
+VECTORIZER_TORCH_THREADS = int(os.getenv('VECTORIZER_TORCH_THREADS', 0))
+# Chunks queued per worker, so a worker starts its next chunk while the
+# results of the previous one are written to the database.
+VECTORIZER_PREFETCH = 2
+
+executor = None
+
+
+def torch_threads(workers=VECTORIZER_WORKERS):
+    if VECTORIZER_TORCH_THREADS > 0:
+        return VECTORIZER_TORCH_THREADS
+    return max((os.cpu_count() or 1) // max(workers, 1), 1)
+
+
+def init_worker(threads):
+    # Each worker gets its share of the cores for the intra-op parallelism of
+    # torch, then loads CamemBERT and the PCA and TF-IDF models once.
+    import torch
+    torch.set_num_threads(threads)
+    importlib.import_module('microservices.utils.vectors')
+    print(f"Vectorizer worker {os.getpid()} ready ({threads} torch threads).")
+
+
+def vectorize_chunk(rows, refresh_tfidf):
+    from microservices.utils.vectors import vectorize_rows
+    return vectorize_rows(rows, refresh_tfidf)
+
+
+def get_executor():
+    # VECTORIZER_WORKERS=0 keeps the models of the vectorizer process and
+    # runs the chunks one at a time in a thread, still off the event loop.
+    global executor
+    if executor is None:
+        if VECTORIZER_WORKERS > 0:
+            # spawn: torch is not fork-safe once its thread pools exist.
+            executor = ProcessPoolExecutor(
+                max_workers=VECTORIZER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(torch_threads(),))
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+    return executor
+
+
+async def vectorize_in_workers(chunks, write, refresh_tfidf=True):
+    # Chunks of rows, read from the async iterable `chunks` only when a worker
+    # can take them, are fed to the workers as they free up, and each result
+    # is handed to `write` as soon as it is ready, in completion order.
+    loop = asyncio.get_running_loop()
+    pool = get_executor()
+    max_pending = max(VECTORIZER_WORKERS, 1) * VECTORIZER_PREFETCH
+    pending = set()
+
+    try:
+        async for rows in chunks:
+            chunk = [dict(row) for row in rows]
+            pending.add(loop.run_in_executor(pool, vectorize_chunk, chunk, refresh_tfidf))
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    await write(future.result())
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                await write(future.result())
+    except BrokenProcessPool:
+        # A worker died (e.g. killed when out of memory): the next run starts
+        # a new pool.
+        shutdown_workers()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shutdown_workers():
+    global executor
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
@@ -1,25 +1,28 @@
+import argparse
 import asyncio
+import time
 import mlflow
 import asyncpg
 from datetime import datetime, timedelta
 from tqdm.asyncio import tqdm
 from common.setup_mlflow_autolog import setup_mlflow_autolog
-from common.utils import reconnect, execute_batch_updates, TABLE_NAME
-from microservices.utils.vectors import generate_vectors_for_row, retrain_tfidf_model, initialize_pca_model, initialize_tfidf_model
+from common.utils import reconnect, execute_batch_updates, bump_vectors_version, TABLE_NAME
+from microservices.utils.snapshot import publish_embedding_snapshot
+from microservices.utils.neighbors import update_neighbors
+from common.facets import refresh_facets_view
+from microservices.utils.vectors import retrain_tfidf_model, initialize_pca_model, initialize_tfidf_model, reset_embedding_stats, log_embedding_throughput, reload_models_if_changed, tfidf_vector_strings, embedding_stats, EMBEDDING_CHUNK_SIZE, TFIDF_CHUNK_SIZE
+from microservices.utils.workers import vectorize_in_workers, VECTORIZER_WORKERS
 
 setup_mlflow_autolog(experiment_name="vectorizer_monitoring")
 
 
-async def update_combined_vectors(conn, recalculate_all=False):
+async def update_combined_vectors(conn, recalculate_all=False, refresh_tfidf=True):
     start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     with mlflow.start_run(run_name="update_combined_vectors_run"):
-        print("Fetching rows to update vectors...")
-        query = f"SELECT * FROM {TABLE_NAME}"
-        if not recalculate_all:
-            query += " WHERE embedding IS NULL OR tfidf IS NULL"
-
-        rows = await conn.fetch(query)
-        if not rows:
+        print("Counting rows to update vectors...")
+        condition = "" if recalculate_all else " AND (embedding IS NULL OR tfidf IS NULL)"
+        num_rows = await conn.fetchval(f"SELECT count(*) FROM {TABLE_NAME} WHERE TRUE{condition}")
+        if not num_rows:
             print("Nothing to calculate.")
             mlflow.log_param("num_rows", 0)
 
@@ -29,33 +32,129 @@ async def update_combined_vectors(conn, recalculate_all=False):
             mlflow.log_param("end_time", end_time)
             mlflow.log_param("recalculate_all", recalculate_all)
             return
-        print(f"Fetched {len(rows)} rows for processing.")
+        print(f"Found {num_rows} rows for processing.")
+
+        async def row_chunks():
+            # The rows are read by id ranges, one chunk ahead of the workers,
+            # so memory stays bounded whatever the size of the catalogue.
+            last_id = ''
+            while True:
+                rows = await conn.fetch(f"""
+                    SELECT id, resume, product_title, embedding IS NOT NULL AS has_embedding,
+                           utils->>'embedding_hash' AS embedding_hash,
+                           utils->>'embedding_version' AS embedding_version
+                    FROM {TABLE_NAME}
+                    WHERE id > $1{condition}
+                    ORDER BY id
+                    LIMIT $2
+                """, last_id, EMBEDDING_CHUNK_SIZE)
+                if not rows:
+                    return
+                last_id = rows[-1]['id']
+                yield rows
 
         batch_size = 100
-        updates = []
-
-        for row in tqdm(rows, desc="Processing rows", unit="row"):
-            embedding_vector, tfidf_vector = generate_vectors_for_row(row)
+        reset_embedding_stats()
+        started = time.perf_counter()
+        embedded_ids = []
+        num_processed = 0
+        # The embedding is only replaced when one is given; the hash of its
+        # input text and the model version are merged into utils, which the
+        # other services also write.
+        update_query = f"""
+            UPDATE {TABLE_NAME}
+            SET embedding = COALESCE($1::vector, embedding), tfidf = $2,
+                utils = COALESCE(utils, '{{}}'::jsonb)
+                    || jsonb_build_object('embedding_hash', $3::text, 'embedding_version', $4::text)
+            WHERE id = $5
+        """
+
+        # Rows are embedded a chunk at a time on the worker pool, so CamemBERT
+        # runs on batches of texts of similar length and the event loop keeps
+        # writing the finished chunks meanwhile.
+        with tqdm(total=num_rows, desc="Processing rows", unit="row") as progress:
+            async def write_chunk(result):
+                nonlocal num_processed
+                updates, stats, row_count = result
+                for batch_start in range(0, len(updates), batch_size):
+                    await execute_batch_updates(
+                        conn, updates[batch_start:batch_start + batch_size], update_query)
+                embedded_ids.extend(update[-1] for update in updates if update[0] is not None)
+                for key, value in stats.items():
+                    embedding_stats[key] += value
+                num_processed += row_count
+                progress.update(row_count)
+
+            await vectorize_in_workers(row_chunks(), write_chunk, refresh_tfidf)
+
+        log_embedding_throughput(time.perf_counter() - started)
+        print(f"Updated the embedding of {len(embedded_ids)} of {num_processed} rows, "
+              f"the others kept their embedding" + (" and only got a new TF-IDF vector." if refresh_tfidf else "."))
+
+        # Neighbours only depend on the embeddings, so only the lists around
+        # the re-embedded books are refreshed; a full run also drops the
+        # books deleted from the catalogue.
+        num_neighbors = await update_neighbors(
+            conn, embedded_ids, prune_deleted=recalculate_all)
+        await publish_embedding_snapshot(conn)
+        await bump_vectors_version(conn)
+        # New rows are vectorised shortly after being loaded, so the facet
+        # counts follow the catalogue without a job of their own.
+        await refresh_facets_view(conn)
 
-            embedding_vector_str = '[' + \
-                ','.join(map(str, embedding_vector)) + ']'
-            tfidf_vector_str = '[' + ','.join(map(str, tfidf_vector)) + ']'
+        end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            updates.append((embedding_vector_str, tfidf_vector_str, row['id']))
+        mlflow.log_param("start_time", start_time)
+        mlflow.log_param("end_time", end_time)
+        mlflow.log_param("num_rows", num_processed)
+        mlflow.log_param("num_rows_embedded", len(embedded_ids))
+        mlflow.log_param("num_neighbors_refreshed", num_neighbors)
+        mlflow.log_param("recalculate_all", recalculate_all)
+        mlflow.log_param("refresh_tfidf", refresh_tfidf)
+        mlflow.log_param("vectorizer_workers", VECTORIZER_WORKERS)
 
-            if len(updates) >= batch_size:
-                await execute_batch_updates(conn, updates, f"UPDATE {TABLE_NAME} SET embedding = $1, tfidf = $2 WHERE id = $3")
-                updates = []
 
-        if updates:
-            await execute_batch_updates(conn, updates, f"UPDATE {TABLE_NAME} SET embedding = $1, tfidf = $2 WHERE id = $3")
+async def refresh_tfidf_vectors(conn):
+    start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with mlflow.start_run(run_name="refresh_tfidf_vectors_run"):
+        # The retrained vectorizer is read from disk, then the catalogue is
+        # read by id ranges, so no transaction stays open for the whole run.
+        reload_models_if_changed()
+        batch_size = 100
+        num_rows = 0
+        last_id = ''
+        started = time.perf_counter()
+
+        while True:
+            rows = await conn.fetch(
+                f"SELECT id, resume FROM {TABLE_NAME} WHERE id > $1 ORDER BY id LIMIT $2",
+                last_id, TFIDF_CHUNK_SIZE)
+            if not rows:
+                break
+
+            vector_strings = await asyncio.to_thread(
+                tfidf_vector_strings, [row['resume'] for row in rows])
+            updates = [(vector_string, row['id']) for vector_string, row in zip(vector_strings, rows)]
+            for batch_start in range(0, len(updates), batch_size):
+                await execute_batch_updates(
+                    conn, updates[batch_start:batch_start + batch_size],
+                    f"UPDATE {TABLE_NAME} SET tfidf = $1 WHERE id = $2")
+
+            num_rows += len(rows)
+            last_id = rows[-1]['id']
+            print(f"Refreshed the TF-IDF vectors of {num_rows} rows.")
+
+        elapsed = time.perf_counter() - started
+        # The hybrid re-ranking reads the tfidf column, so its cached
+        # results are dropped.
+        await bump_vectors_version(conn)
 
         end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         mlflow.log_param("start_time", start_time)
         mlflow.log_param("end_time", end_time)
-        mlflow.log_param("num_rows", len(rows))
-        mlflow.log_param("recalculate_all", recalculate_all)
+        mlflow.log_param("num_rows", num_rows)
+        mlflow.log_metric("tfidf_rows_per_second", num_rows / elapsed if elapsed else 0.0)
 
 
 async def daily_recalculation_task(conn, lock):
@@ -73,7 +172,10 @@ async def daily_recalculation_task(conn, lock):
         async with lock:
             print("Starting daily TF-IDF retraining and full recalculation of vectors...")
             await retrain_tfidf_model(conn, TABLE_NAME)
-            await update_combined_vectors(conn, recalculate_all=True)
+            # The new vocabulary only changes the tfidf column; the embeddings
+            # are then recomputed for the books whose text changed.
+            await refresh_tfidf_vectors(conn)
+            await update_combined_vectors(conn, recalculate_all=True, refresh_tfidf=False)
             print("Daily recalculation complete.")
 
 
@@ -106,5 +208,27 @@ async def main():
             print(f"Connection error: {e}. Retrying in 30 seconds...")
             await asyncio.sleep(30)
 
+
+async def refresh_tfidf_once(retrain):
+    conn = await reconnect()
+    try:
+        await initialize_tfidf_model(conn, TABLE_NAME)
+        if retrain:
+            await retrain_tfidf_model(conn, TABLE_NAME)
+        await refresh_tfidf_vectors(conn)
+    finally:
+        await conn.close()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Vectorizer service.")
+    parser.add_argument('--tfidf-only', action='store_true',
+                        help="Refresh the tfidf column once and exit, without running CamemBERT.")
+    parser.add_argument('--retrain', action='store_true',
+                        help="With --tfidf-only, retrain the TF-IDF vectorizer first.")
+    args = parser.parse_args()
+
+    if args.tfidf_only:
+        asyncio.run(refresh_tfidf_once(args.retrain))
+    else:
+        asyncio.run(main())
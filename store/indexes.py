@@ -0,0 +1,193 @@
+import asyncio
+import asyncpg
+import os
+import json
+from dotenv import load_dotenv
+from datetime import datetime
+import mlflow
+from common.setup_mlflow_autolog import setup_mlflow_autolog
+
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT')
+POSTGRES_DB = os.getenv('POSTGRES_DB')
+TABLE_NAME = os.getenv('TABLE_NAME')
+
+SCHEMA_PATH = 'data/schemes/books.json'
+
+OPERATOR_CLASSES = {
+    "cosine": "vector_cosine_ops",
+    "euclidean": "vector_l2_ops",
+    "taxicab": "vector_l1_ops",
+}
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+
+SEARCH_CONFIG = 'french_unaccent'
+
+
+def load_index_specs(path=SCHEMA_PATH):
+    with open(path, 'r') as file:
+        schema = json.load(file)
+    return schema.get('vector_indexes', [])
+
+
+def index_name(spec):
+    return f"{TABLE_NAME}_{spec['column']}_{spec['metric']}_{spec['method']}_idx"
+
+
+def validate_index_spec(spec):
+    if spec['metric'] not in OPERATOR_CLASSES:
+        raise ValueError(
+            f"Unknown metric '{spec['metric']}', expected one of {', '.join(OPERATOR_CLASSES)}.")
+    if spec['method'] not in INDEX_METHODS:
+        raise ValueError(
+            f"Unknown index method '{spec['method']}', expected one of {', '.join(INDEX_METHODS)}.")
+    if spec['method'] == 'ivfflat' and spec['metric'] == 'taxicab':
+        raise ValueError("pgvector IVFFlat indexes do not support the taxicab (L1) distance.")
+
+
+async def ivfflat_lists(conn):
+    # pgvector guidance: rows / 1000 lists up to 1M rows, sqrt(rows) above.
+    rows = await conn.fetchval(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE embedding IS NOT NULL")
+    if rows > 1_000_000:
+        return max(int(rows ** 0.5), 1)
+    return max(rows // 1000, 1)
+
+
+async def build_index_statement(conn, spec):
+    validate_index_spec(spec)
+    options = dict(spec.get('options', {}))
+    if spec['method'] == 'ivfflat' and 'lists' not in options:
+        options['lists'] = await ivfflat_lists(conn)
+
+    statement = (
+        f"CREATE INDEX IF NOT EXISTS {index_name(spec)} ON {TABLE_NAME} "
+        f"USING {spec['method']} ({spec['column']} {OPERATOR_CLASSES[spec['metric']]})"
+    )
+    if options:
+        statement += " WITH (" + ", ".join(f"{key} = {int(value)}" for key, value in options.items()) + ")"
+    return statement
+
+
+async def create_vector_indexes(conn, specs=None):
+    specs = load_index_specs() if specs is None else specs
+    for spec in specs:
+        statement = await build_index_statement(conn, spec)
+        print(f"Creating index {index_name(spec)}...")
+        await conn.execute(statement)
+
+
+async def drop_vector_indexes(conn, specs=None):
+    specs = load_index_specs() if specs is None else specs
+    for spec in specs:
+        print(f"Dropping index {index_name(spec)}...")
+        await conn.execute(f"DROP INDEX IF EXISTS {index_name(spec)}")
+
+
+async def rebuild_vector_indexes(conn, specs=None):
+    specs = load_index_specs() if specs is None else specs
+    for spec in specs:
+        if spec['method'] == 'ivfflat':
+            # IVFFlat centroids are computed at build time, recreate them
+            # so the lists match the data loaded since.
+            await drop_vector_indexes(conn, [spec])
+            await create_vector_indexes(conn, [spec])
+        else:
+            print(f"Reindexing {index_name(spec)}...")
+            await conn.execute(f"REINDEX INDEX {index_name(spec)}")
+    await conn.execute(f"ANALYZE {TABLE_NAME}")
+
+
+async def create_search_index(conn):
+    # unaccent() is only STABLE, so it can't be called by a generated column;
+    # a text search configuration using it as a dictionary is immutable.
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS unaccent;")
+    config_exists = await conn.fetchval(
+        "SELECT EXISTS (SELECT FROM pg_ts_config WHERE cfgname = $1)", SEARCH_CONFIG)
+    if not config_exists:
+        await conn.execute(f"CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = french)")
+        await conn.execute(f"""
+            ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG}
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem
+        """)
+
+    await conn.execute(f"""
+        ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(product_title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(author, '')), 'B') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(resume, '')), 'C')
+        ) STORED
+    """)
+    print(f"Creating index {TABLE_NAME}_search_vector_idx...")
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {TABLE_NAME}_search_vector_idx
+        ON {TABLE_NAME} USING GIN (search_vector)
+    """)
+
+
+async def list_vector_indexes(conn):
+    rows = await conn.fetch(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = $1 AND indexdef ~* 'USING (hnsw|ivfflat)'",
+        TABLE_NAME
+    )
+    for row in rows:
+        print(f"{row['indexname']}: {row['indexdef']}")
+    return rows
+
+
+async def main(action, specs):
+    conn = await asyncpg.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+
+    if action == "create":
+        await create_vector_indexes(conn, specs)
+    elif action == "drop":
+        await drop_vector_indexes(conn, specs)
+    elif action == "rebuild":
+        await rebuild_vector_indexes(conn, specs)
+    elif action == "search":
+        await create_search_index(conn)
+    await list_vector_indexes(conn)
+    await conn.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Manage the ANN indexes of the embedding column.")
+    parser.add_argument("action", choices=["create", "drop", "rebuild", "list", "search"],
+                        help="Action to run on the vector indexes, or 'search' to create the full-text search index.")
+    parser.add_argument("--metric", choices=list(OPERATOR_CLASSES),
+                        help="Only handle the indexes of this metric.")
+    parser.add_argument("--method", choices=list(INDEX_METHODS),
+                        help="Override the index method declared in the schema.")
+
+    args = parser.parse_args()
+
+    specs = load_index_specs()
+    if args.metric:
+        specs = [spec for spec in specs if spec['metric'] == args.metric]
+    if args.method:
+        specs = [dict(spec, method=args.method, options={} if spec['method'] != args.method else spec.get('options', {}))
+                 for spec in specs]
+
+    setup_mlflow_autolog(experiment_name="compress_prepare_load")
+    start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with mlflow.start_run(run_name="indexes_run"):
+        asyncio.run(main(args.action, specs))
+
+        mlflow.log_param("start_time", start_time)
+        mlflow.log_param("end_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        mlflow.log_param("action", args.action)
+        mlflow.log_param("indexes", [index_name(spec) for spec in specs])
@@ -10,6 +10,8 @@ from datetime import datetime
 import mlflow
 import mlflow.sklearn
 from common.setup_mlflow_autolog import setup_mlflow_autolog
+from store.indexes import create_vector_indexes, create_search_index
+from common.facets import refresh_facets_view
 
 setup_mlflow_autolog(experiment_name="compress_prepare_load")
 
@@ -69,8 +71,18 @@ async def create_table(conn):
         """)
 
 
+async def create_indexes(conn):
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {TABLE_NAME}_date_de_parution_id_idx
+        ON {TABLE_NAME} (date_de_parution, id)
+    """)
+    await create_vector_indexes(conn)
+    await create_search_index(conn)
+
+
 async def drop_table(conn):
-    await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+    # CASCADE also drops the facet counts view, recreated after the load.
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME} CASCADE")
 
 
 async def insert_data(conn, data):
@@ -120,7 +132,9 @@ async def main(drop_flag=False):
         await drop_table(conn)
 
     await create_table(conn)
+    await create_indexes(conn)
     await insert_data(conn, data)
+    await refresh_facets_view(conn)
     await retrieve_data(conn)
     await conn.close()
 